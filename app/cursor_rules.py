@@ -1,21 +1,75 @@
-import os
+import re
+import json
 import logging
-import base64
-from typing import Dict, List, Optional
+import binascii
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
 from github import Github, Repository, GithubException
 from github.GithubException import RateLimitExceededException
+from github.ContentFile import ContentFile
+from github.Requester import Requester
 import time
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+from cachetools import LRUCache
+from .prompts import NO_EXISTING_RULES
 
 logger = logging.getLogger(__name__)
 
+_GLOB_SPLIT = re.compile(r'\s*,\s*')
+
+# Files without frontmatter only have their first few lines checked for metadata
+_HEADER_SCAN_LIMIT = 2048
+# Base64 characters (including GitHub's line breaks every 60) covering the header
+_ENCODED_HEADER_LIMIT = (_HEADER_SCAN_LIMIT // 3 + 1) * 4 * 61 // 60
+
+# Maximum number of rule blobs fetched from GitHub concurrently
+MAX_BLOB_FETCH_WORKERS = 8
+
+# Maximum number of GitHub API calls in flight at once across all threads
+MAX_CONCURRENT_GITHUB_CALLS = 8
+_github_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_GITHUB_CALLS)
+
+# Parsed rules per "owner/repo@ref" with the validators of the rules directory
+# listing they came from: (etag, last_modified, rules). Lets a moving ref like a
+# branch be revalidated with a conditional request instead of refetching every blob.
+_rules_by_listing = LRUCache(maxsize=256)
+_rules_by_listing_lock = threading.Lock()
+# Returned by get_rules_listing_conditional when the cached listing is still current
+NOT_MODIFIED = object()
+
 class CursorRule(BaseModel):
     """Represents a single Cursor rule file"""
+    model_config = ConfigDict(populate_by_name=True)
+
     name: str
     description: str
     globs: List[str]
-    content: str
+    decoded_content: Optional[str] = Field(default=None, alias="content")
     file_path: str
+    sha: Optional[str] = None  # Blob SHA, when the rule was read from the rules directory listing
+    # Base64 body from GitHub, decoded the first time content is read
+    _encoded_content: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def content(self) -> str:
+        """The full rule file content, decoding it on first access if needed"""
+        if self._encoded_content is not None:
+            self.decoded_content = decode_github_content(self._encoded_content)
+            self._encoded_content = None
+        return self.decoded_content or ""
+
+    def defer_content(self, encoded_content: str) -> None:
+        """Replace the content with base64 data that is only decoded when needed"""
+        self.decoded_content = None
+        self._encoded_content = encoded_content
+
+    @cached_property
+    def globs_set(self) -> FrozenSet[str]:
+        """The rule's globs as a frozenset, built once for repeated comparisons"""
+        return frozenset(self.globs)
 
 def get_rules_directory() -> str:
     """Get the path to the cursor rules directory"""
@@ -25,19 +79,28 @@ def parse_rule_content(content: str, file_path: str) -> Optional[CursorRule]:
     """Parse rule content from a .mdc file"""
     try:
         # Extract name from filepath
-        name = os.path.splitext(os.path.basename(file_path))[0]
+        slash = file_path.rfind('/')
+        dot = file_path.rfind('.')
+        name = file_path[slash + 1:dot if dot > slash + 1 else len(file_path)]
         
-        # Parse description and globs from content
+        # Parse description and globs from the frontmatter only
         description = ""
         globs = []
         
-        lines = content.split('\n')
-        for line in lines:
-            if line.startswith('description:'):
-                description = line.replace('description:', '').strip()
-            elif line.startswith('globs:'):
-                globs_str = line.replace('globs:', '').strip()
-                globs = [g.strip() for g in globs_str.split(',') if g.strip()]
+        header = content[:_HEADER_SCAN_LIMIT]
+        if content.startswith('---\n'):
+            frontmatter_end = content.find('\n---', 3)
+            if frontmatter_end != -1:
+                header = content[4:frontmatter_end]
+        
+        for line in header.split('\n'):
+            key, sep, value = line.partition(':')
+            if not sep:
+                continue
+            if key == 'description':
+                description = value.strip()
+            elif key == 'globs':
+                globs = [g for g in _GLOB_SPLIT.split(value.strip()) if g]
         
         return CursorRule(
             name=f"{name}.mdc",
@@ -50,12 +113,15 @@ def parse_rule_content(content: str, file_path: str) -> Optional[CursorRule]:
         logger.error(f"Failed to parse rule file {file_path}: {str(e)}")
         return None
 
-def get_contents_with_retry(repo: Repository, path: str, ref: str = None, max_retries: int = 3) -> Optional[List]:
-    """Get contents from GitHub with rate limit handling and retries"""
+def github_call_with_retry(repo: Repository, func: Callable, *args, max_retries: int = 3, **kwargs):
+    """Call a GitHub API method with rate limit handling and retries.
+    Returns None if the requested resource does not exist. Sleeps between retries,
+    so async callers must run it (and anything built on it) in a worker thread."""
     for attempt in range(max_retries):
         try:
-            contents = repo.get_contents(path, ref=ref)
-            return contents if isinstance(contents, list) else [contents]
+            # Only hold a slot while the request is in flight, never while backing off
+            with _github_call_slots:
+                return func(*args, **kwargs)
         except RateLimitExceededException as e:
             reset_time = repo.rate_limiting_resettime
             wait_time = reset_time - int(time.time())
@@ -70,34 +136,147 @@ def get_contents_with_retry(repo: Repository, path: str, ref: str = None, max_re
             logger.error(f"GitHub API error: {str(e)}")
             if attempt == max_retries - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            time.sleep(2 ** attempt + random.random())  # Exponential backoff with jitter
     return None
 
+def get_contents_with_retry(repo: Repository, path: str, ref: str = None, max_retries: int = 3) -> Optional[List]:
+    """Get contents from GitHub with rate limit handling and retries"""
+    contents = github_call_with_retry(repo, repo.get_contents, path, ref=ref, max_retries=max_retries)
+    if contents is None:
+        return None
+    return contents if isinstance(contents, list) else [contents]
+
+def github_request_json(
+    requester: Requester, url: str, parameters: Optional[Dict] = None, headers: Optional[Dict] = None
+) -> Tuple[int, Dict, object]:
+    """GET a GitHub API URL through PyGithub's requester, for the conditional requests
+    its public API doesn't expose. The one place the app calls requestJson directly.
+    
+    Returns (status, headers, data) with a 304 passed through; error statuses raise the
+    same exception types as PyGithub's own calls, so retries see rate limits.
+    """
+    status, response_headers, body = requester.requestJson("GET", url, parameters, headers)
+    if status == 304:
+        return status, response_headers, None
+    data = json.loads(body) if body else None
+    if status >= 400:
+        raise Requester.createException(status, response_headers, data)
+    return status, response_headers, data
+
+def get_rules_listing_conditional(repo: Repository, ref: str, validators: Optional[Tuple[str, str]] = None):
+    """List the .mdc files in the rules directory with the contents API.
+    
+    Returns (entries, etag, last_modified). With the (etag, last_modified) validators
+    of an earlier listing, sends a conditional request and returns NOT_MODIFIED if
+    GitHub answers 304, which doesn't count against the rate limit. The listing only
+    changes when a rule file does, unlike the tree of the whole ref.
+    """
+    request_headers = {}
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            request_headers["If-None-Match"] = etag
+        # Token independent, so still validates after the installation token rotates
+        if last_modified:
+            request_headers["If-Modified-Since"] = last_modified
+    
+    status, headers, data = github_request_json(
+        repo.requester, f"{repo.url}/contents/{get_rules_directory()}", {"ref": ref}, request_headers
+    )
+    if status == 304:
+        return NOT_MODIFIED
+    
+    # A file at the rules path instead of a directory has no rules in it
+    entries = [
+        ContentFile(repo.requester, headers, item, completed=False)
+        for item in (data if isinstance(data, list) else [])
+        if item.get("type") == "file" and item.get("name", "").endswith('.mdc')
+    ]
+    return entries, headers.get("etag"), headers.get("last-modified")
+
+def decode_github_content(raw) -> str:
+    """Decode base64 content returned by the GitHub API.
+    a2b_base64 skips the embedded newlines GitHub adds, so no extra cleanup is needed."""
+    raw_bytes = raw.encode('ascii') if isinstance(raw, str) else raw
+    return binascii.a2b_base64(raw_bytes).decode('utf-8')
+
+def decode_github_content_head(raw: str) -> str:
+    """Decode only the start of base64 content returned by the GitHub API.
+    Covers at least the first _HEADER_SCAN_LIMIT bytes of the file."""
+    chunk = "".join(raw[:_ENCODED_HEADER_LIMIT].split())
+    chunk = chunk[:len(chunk) - len(chunk) % 4]
+    head = binascii.a2b_base64(chunk.encode('ascii'))
+    try:
+        return head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Only tolerate a multi-byte character cut off at the end of the chunk
+        if e.start < len(head) - 3:
+            raise
+        return head[:e.start].decode('utf-8')
+
+def parse_encoded_rule(raw: str, file_path: str) -> Optional[CursorRule]:
+    """Parse a rule from GitHub's base64 content, parsing only the frontmatter up front.
+    The whole file is checked to decode, but only kept as a string once the rule's
+    content is read."""
+    if len(raw) > _ENCODED_HEADER_LIMIT:
+        head = decode_github_content_head(raw)
+        if head.startswith('---\n') and head.find('\n---', 3) != -1:
+            rule = parse_rule_content(head, file_path)
+            if rule:
+                # Fail on an undecodable body here, where fetch_rule_blob skips the
+                # rule, rather than wherever the content is first read
+                decode_github_content(raw)
+                rule.defer_content(raw)
+            return rule
+    
+    # Small file, or the frontmatter doesn't fit in the head: decode everything
+    return parse_rule_content(decode_github_content(raw), file_path)
+
+def fetch_rule_blob(repo: Repository, entry) -> Optional[CursorRule]:
+    """Fetch a single rule blob and parse it into a CursorRule"""
+    try:
+        blob = github_call_with_retry(repo, repo.get_git_blob, entry.sha)
+        if blob is None:
+            return None
+        rule = parse_encoded_rule(blob.content, entry.path)
+        if rule:
+            rule.sha = entry.sha
+        return rule
+    except Exception as e:
+        logger.error(f"Error processing rule file {entry.path}: {str(e)}")
+        return None
+
 def get_current_rules(repo: Repository, ref: str = None) -> List[CursorRule]:
     """Get all current cursor rules in the repository using GitHub API
     
+    Lists the rules directory and fetches the blobs in parallel.
+    
     Args:
         repo: The GitHub repository object
         ref: The branch/commit reference to fetch from (e.g., PR head branch)
     """
     rules = []
+    ref = ref or repo.default_branch
+    cache_key = f"{repo.full_name}@{ref}"
+    with _rules_by_listing_lock:
+        cached = _rules_by_listing.get(cache_key)
     
     try:
         # Only check .cursor/rules directory as that's the only valid location
-        rules_dir = get_rules_directory()
-        dir_contents = get_contents_with_retry(repo, rules_dir, ref=ref)
+        listing = github_call_with_retry(
+            repo, get_rules_listing_conditional, repo, ref, cached[:2] if cached else None
+        )
+        if listing is NOT_MODIFIED:
+            logger.debug(f"Rules directory for {cache_key} not modified, reusing parsed rules")
+            # A copy, so callers can't change the cached list under other requests
+            return list(cached[2])
+        entries, etag, last_modified = listing if listing is not None else ([], None, None)
         
-        if dir_contents:
-            for content in dir_contents:
-                if content.path.endswith('.mdc'):
-                    try:
-                        file_content = base64.b64decode(content.content).decode('utf-8')
-                        rule = parse_rule_content(file_content, content.path)
-                        if rule:
-                            rules.append(rule)
-                    except Exception as e:
-                        logger.error(f"Error processing rule file {content.path}: {str(e)}")
-                        continue
+        if entries:
+            with ThreadPoolExecutor(max_workers=min(MAX_BLOB_FETCH_WORKERS, len(entries))) as executor:
+                for rule in executor.map(lambda entry: fetch_rule_blob(repo, entry), entries):
+                    if rule:
+                        rules.append(rule)
         else:
             logger.info("No .cursor/rules directory found")
                     
@@ -106,17 +285,19 @@ def get_current_rules(repo: Repository, ref: str = None) -> List[CursorRule]:
         if isinstance(e, RateLimitExceededException):
             logger.error(f"Rate limit exceeded. Reset time: {repo.rate_limiting_resettime}")
         raise
-        
+    
+    # Header values are strings; anything else means there's nothing to revalidate with
+    if isinstance(etag, str) or isinstance(last_modified, str):
+        with _rules_by_listing_lock:
+            _rules_by_listing[cache_key] = (etag, last_modified, rules)
     return rules
 
 def format_rules_for_llm(rules: List[CursorRule]) -> str:
     """Format cursor rules in a way that's easy for the LLM to understand"""
     if not rules:
-        return "No existing Cursor rules found in the repository."
-    
-    formatted = "Current Cursor Rules in Repository:\n\n"
-    for rule in rules:
-        formatted += f"Rule: {rule.file_path}\n"
-        formatted += f"```mdc\n{rule.content}\n```\n\n"
+        return NO_EXISTING_RULES
     
-    return formatted 
\ No newline at end of file
+    return "Current Cursor Rules in Repository:\n\n" + "".join(
+        f"Rule: {rule.file_path}\n```mdc\n{rule.content}\n```\n\n"
+        for rule in rules
+    ) 
\ No newline at end of file
@@ -3,13 +3,22 @@ from .constants import SUMMARY_SIGNATURE, SUGGESTION_SIGNATURE, APPLIED_SIGNATUR
 from .models import SummaryState
 from .prompts import RuleGenerationOutput, RuleChange
 from .rule_applier import merge_rule_changes
+import io
+import itertools
 import json
-from typing import List, Tuple
+from typing import Callable, List, Tuple
 import logging
 import difflib
 
 logger = logging.getLogger(__name__)
 
+# Fixed layout of the new-file section of a suggestion comment
+_NEW_FILE_TEMPLATE = (
+    "\n**Description:**\n```\n{description}\n```\n\n"
+    "**Globs:**\n```\n{globs}\n```\n"
+    "Content:\n```diff\n{body}\n```\n\n"
+)
+
 def generate_diff(old_text: str, new_text: str) -> List[Tuple[str, str]]:
     """Generate a GitHub-style diff between old and new text.
     Returns a list of tuples (prefix, line) where prefix is:
@@ -20,22 +29,59 @@ def generate_diff(old_text: str, new_text: str) -> List[Tuple[str, str]]:
     old_lines = old_text.split('\n')
     new_lines = new_text.split('\n')
     
-    differ = difflib.Differ()
-    diff = list(differ.compare(old_lines, new_lines))
+    # Opcodes are all we need here; Differ's intraline hints are discarded anyway
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
     
-    # Convert differ output to GitHub style
     result = []
-    for line in diff:
-        if line.startswith('  '):  # Unchanged
-            result.append((' ', line[2:]))
-        elif line.startswith('- '):  # Removed
-            result.append(('-', line[2:]))
-        elif line.startswith('+ '):  # Added
-            result.append(('+', line[2:]))
-        # Skip '?' lines from differ output
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            result.extend((' ', line) for line in old_lines[i1:i2])
+            continue
+        # 'replace' shows the removed lines followed by the added ones
+        if tag in ('delete', 'replace'):
+            result.extend(('-', line) for line in old_lines[i1:i2])
+        if tag in ('insert', 'replace'):
+            result.extend(('+', line) for line in new_lines[j1:j2])
     
     return result
 
+def split_mdc_file(content: str) -> Tuple[str, str]:
+    """Split an .mdc file into its (frontmatter, body) parts"""
+    if content.startswith('---\n'):
+        parts = content.split('---\n', 2)
+        if len(parts) >= 3:
+            return parts[1], parts[2]
+    return '', content
+
+def write_unified_diff(w: Callable[[str], object], old_text: str, new_text: str) -> None:
+    """Write the hunks of a line-based unified diff, without the file headers.
+    Context lines lose their leading diff marker and are indented by one space."""
+    diff = difflib.unified_diff(old_text.split('\n'), new_text.split('\n'), lineterm='')
+    # Skip the first two lines (diff headers)
+    for line in itertools.islice(diff, 2, None):
+        if line.startswith(('+', '-')):
+            w(line)
+        else:
+            w(' ')
+            w(line[1:])
+        w('\n')
+
+def find_context_index(stripped_lines: List[str], context_lines: List[str]) -> int:
+    """Find the first index where context_lines appear in stripped_lines, ignoring surrounding whitespace.
+    stripped_lines must already be stripped so callers can reuse them across searches.
+    Returns -1 if the context is not found."""
+    context = [line.strip() for line in context_lines]
+    n = len(context)
+    if n == 0:
+        return -1
+    
+    first = context[0]
+    for i in range(len(stripped_lines) - n + 1):
+        # Cheap first-line check before comparing the whole window
+        if stripped_lines[i] == first and stripped_lines[i:i + n] == context:
+            return i
+    return -1
+
 def format_suggestion_comment(rule: RuleGenerationOutput, thread_root_id: int, current_rules: List[CursorRule]) -> str:
     """Format a comment with the rule suggestion and checkbox.
     Includes:
@@ -44,175 +90,155 @@ def format_suggestion_comment(rule: RuleGenerationOutput, thread_root_id: int, c
     3. A human-readable diff showing the changes based on current rules
     4. A checkbox for accepting the suggestion
     """
+    buf = io.StringIO()
+    w = buf.write
+
+    def write_lines(prefix: str, lines: List[str]) -> None:
+        for line in lines:
+            w(prefix)
+            w(line)
+            w("\n")
+
     # Start with the signature and thread marker
-    comment = [
-        SUGGESTION_SIGNATURE,
-        f"<!--thread-root-{thread_root_id}-->",
-        "",
-        f"I suggest {'creating a new rules file called' if rule.operation == 'create' else 'updating'} `{rule.file_path}` as follows:",
-        ""
-    ]
+    w(f"{SUGGESTION_SIGNATURE}\n")
+    w(f"<!--thread-root-{thread_root_id}-->\n")
+    w("\n")
+    w(f"I suggest {'creating a new rules file called' if rule.operation == 'create' else 'updating'} `{rule.file_path}` as follows:\n")
+    w("\n")
 
     # Add the hidden RuleGenerationOutput as JSON
-    comment.extend([
-        "<!--rule-generation-output",
-        json.dumps(rule.model_dump()),
-        "-->",
-        ""
-    ])
+    w("<!--rule-generation-output\n")
+    w(json.dumps(rule.model_dump()))
+    w("\n-->\n\n")
+
+    # Index current rules by path. Rule bodies are only split (and stripped)
+    # once, and only for rules whose content is actually diffed
+    existing_by_path = {r.file_path: r for r in current_rules}
+    lines_by_path = {}
+    stripped_by_path = {}
 
     # Generate human-readable diff for each change
     for change in rule.changes:
         if change.is_new_file:
             print(f"New file: {change.content}")
             
-            comment.extend([
-                "",
-                "**Description:**",
-                "```",
-                f"{change.file_description}",
-                "```",
-                "",
-                "**Globs:**",
-                "```",
-                # Format globs as comma-separated quoted strings
-                ", ".join(f'{g}' for g in (change.file_globs if isinstance(change.file_globs, list) else [change.file_globs])),
-                "```",
-                "Content:",
-                "```diff",
+            # Format globs as comma-separated quoted strings
+            globs = change.file_globs if isinstance(change.file_globs, list) else [change.file_globs]
+            w(_NEW_FILE_TEMPLATE.format(
+                description=change.file_description,
+                globs=", ".join(f'{g}' for g in globs),
                 # Format each line of content with a '+' prefix
-                *[f"+ {line}" for line in change.content.split('\n')],
-                "```",
-                ""
-            ])
+                body="+ " + change.content.replace("\n", "\n+ ")
+            ))
         else:
             # Find the existing rule content
-            existing_rule = next((r for r in current_rules if r.file_path == rule.file_path), None)
-            if not existing_rule:
+            if rule.file_path not in existing_by_path:
                 logger.warning(f"Could not find existing rule {rule.file_path} in current rules")
                 continue
+            existing_rule = existing_by_path[rule.file_path]
+            change_lines = change.content.split('\n')
 
             if change.file_description and change.file_description != existing_rule.description:
-                comment.extend([
-                    "**Description:**",
-                    "```diff",
-                    f"- {existing_rule.description}",
-                    f"+ {change.file_description}",
-                    "```",
-                    ""
-                ])
+                w("**Description:**\n```diff\n")
+                w(f"- {existing_rule.description}\n")
+                w(f"+ {change.file_description}\n")
+                w("```\n\n")
 
              # For existing files, show the diff
-            if change.file_globs and set(change.file_globs) != set(existing_rule.globs):
+            # (identical lists are the common case and skip building a set)
+            if (
+                change.file_globs
+                and change.file_globs != existing_rule.globs
+                and frozenset(change.file_globs) != existing_rule.globs_set
+            ):
                 old_globs = existing_rule.globs if isinstance(existing_rule.globs, list) else [existing_rule.globs]
                 new_globs = change.file_globs if isinstance(change.file_globs, list) else [change.file_globs]
                 
                 old_globs_str = ", ".join(f'"{g}"' for g in old_globs)
                 new_globs_str = ", ".join(f'"{g}"' for g in new_globs)
                 
-                comment.extend([
-                    "**Globs:**",
-                    "```diff",
-                    f"- {old_globs_str}",
-                    f"+ {new_globs_str}",
-                    "```",
-                    ""
-                ])
+                w("**Globs:**\n```diff\n")
+                w(f"- {old_globs_str}\n")
+                w(f"+ {new_globs_str}\n")
+                w("```\n\n")
 
             if change.content:
-                comment.extend([
-                    "**Content:**",
-                    "```diff"
-                ])
+                w("**Content:**\n```diff\n")
                 
                 # Handle replacements separately and early
                 if change.type == "replacement" and change.text_to_replace:
                     # For replacements, we don't need context - we know exactly what to replace
-                    diff_lines = generate_diff(change.text_to_replace, change.content)
-                    for prefix, line in diff_lines:
-                        if prefix == '-':
-                            comment.append(f"-{line}")
-                        elif prefix == '+':
-                            comment.append(f"+{line}")
-                        else:
-                            comment.append(f" {line}")
+                    for prefix, line in generate_diff(change.text_to_replace, change.content):
+                        w(prefix)
+                        w(line)
+                        w("\n")
                 else:
                     # Handle context-based updates and additions
-                    existing_content = existing_rule.content.split('\n')
+                    if rule.file_path not in lines_by_path:
+                        lines_by_path[rule.file_path] = existing_rule.content.split('\n')
+                    existing_content = lines_by_path[rule.file_path]
                     if change.existing_content_context:
                         # Find where to insert/replace based on context
                         context_lines = change.existing_content_context.split('\n')
-                        context_found = False
-                        
-                        for i in range(len(existing_content)):
-                            if i + len(context_lines) <= len(existing_content):
-                                # Check if this position matches the context
-                                if all(existing_content[i+j].strip() == context_lines[j].strip() for j in range(len(context_lines))):
-                                    context_found = True
-                                    # Found the context, show a few lines before
-                                    start_idx = max(0, i - 3)
-                                    for line in existing_content[start_idx:i]:
-                                        comment.append(f" {line}")
-                                    # Show the context line(s)
-                                    for line in existing_content[i:i + len(context_lines)]:
-                                        comment.append(f" {line}")
-                                    
-                                    # Show what's being added
-                                    for line in change.content.split('\n'):
-                                        comment.append(f"+{line}")
-                                    
-                                    # Show a few lines after if there's more content
-                                    end_idx = min(len(existing_content), i + len(context_lines) + 3)
-                                    if i + len(context_lines) < len(existing_content):
-                                        for line in existing_content[i + len(context_lines):end_idx]:
-                                            comment.append(f" {line}")
-                                    break
+                        if rule.file_path not in stripped_by_path:
+                            stripped_by_path[rule.file_path] = [line.strip() for line in existing_content]
+                        i = find_context_index(stripped_by_path[rule.file_path], context_lines)
+                        context_found = i != -1
                         
-                        if not context_found:
+                        if context_found:
+                            # Found the context, show a few lines before
+                            start_idx = max(0, i - 3)
+                            write_lines(" ", existing_content[start_idx:i])
+                            # Show the context line(s)
+                            write_lines(" ", existing_content[i:i + len(context_lines)])
+                            
+                            # Show what's being added
+                            write_lines("+", change_lines)
+                            
+                            # Show a few lines after if there's more content
+                            end_idx = min(len(existing_content), i + len(context_lines) + 3)
+                            if i + len(context_lines) < len(existing_content):
+                                write_lines(" ", existing_content[i + len(context_lines):end_idx])
+                        else:
                             # If context wasn't found, show the content as an addition at the end
                             logger.warning(f"Could not find context '{change.existing_content_context}' in {rule.file_path}")
                             if existing_content:
-                                for line in existing_content[-3:]:
-                                    comment.append(f" {line}")
-                            for line in change.content.split('\n'):
-                                comment.append(f"+{line}")
+                                write_lines(" ", existing_content[-3:])
+                            write_lines("+", change_lines)
                     else:
                         # No context, just append at the end
                         # Show last few lines of existing content
                         if existing_content:
-                            for line in existing_content[-3:]:
-                                comment.append(f" {line}")
+                            write_lines(" ", existing_content[-3:])
                         # Show the new content
-                        for line in change.content.split('\n'):
-                            comment.append(f"+{line}")
+                        write_lines("+", change_lines)
 
-                comment.extend([
-                    "```",
-                    ""
-                ])
+                w("```\n\n")
 
     # Add the checkbox
-    comment.extend([
-        "Check the box below to add this suggestion to the summary of suggested changes. **Clicking will NOT commit anything to the PR.**",
-        "- [ ] Accept this suggestion?",
-    ])
+    w("Check the box below to add this suggestion to the summary of suggested changes. **Clicking will NOT commit anything to the PR.**\n")
+    w("- [ ] Accept this suggestion?")
 
-    return "\n".join(comment)
+    return buf.getvalue()
 
 def format_summary_comment(state: SummaryState, current_rules: List[CursorRule]) -> str:
     """Format the summary comment based on current state.
     Shows a combined diff of all changes that would be applied.
     """
-    summary = f"{SUMMARY_SIGNATURE}\n\n"
+    out = io.StringIO()
+    w = out.write
+    w(f"{SUMMARY_SIGNATURE}\n\n")
     
     if state.is_applied:
-        summary += f"{APPLIED_SIGNATURE}\n"
-        summary += "These rules have been applied to the codebase. This PR's suggestions are now locked.\n\n"
-        summary += "Applied Changes:\n"
+        w(f"{APPLIED_SIGNATURE}\n")
+        w("These rules have been applied to the codebase. This PR's suggestions are now locked.\n\n")
+        w("Applied Changes:\n")
     else:
-        summary += "Changes to be applied:\n"
+        w("Changes to be applied:\n")
     
     if not state.is_empty():
+        rules_by_path = {r.file_path: r for r in current_rules}
+
         # Group changes by file
         changes_by_file = {}
         for suggestion_id, rule_output in state.suggestions:
@@ -223,10 +249,10 @@ def format_summary_comment(state: SummaryState, current_rules: List[CursorRule])
         
         # Process each file's changes
         for file_path, file_changes in changes_by_file.items():
-            summary += f"\nFile: `{file_path}`"
+            w(f"\nFile: `{file_path}`")
             
             # Find existing rule if this is an update
-            existing_rule = next((r for r in current_rules if r.file_path == file_path), None)
+            existing_rule = rules_by_path.get(file_path)
             current_content = existing_rule.content if existing_rule else None
             
             # Get the merged content
@@ -235,74 +261,43 @@ def format_summary_comment(state: SummaryState, current_rules: List[CursorRule])
             # Format the diff
             if not existing_rule:
                 # For new files, show everything as added
-                summary += " (new file)\n```diff\n"
-                for line in final_content.split('\n'):
-                    summary += f"+ {line}\n"
-                summary += "```\n"
+                w(" (new file)\n```diff\n")
+                w("+ ")
+                w(final_content.replace("\n", "\n+ "))
+                w("\n")
+                w("```\n")
             else:
-                summary += "\n```diff\n"
+                w("\n```diff\n")
                 
                 # Split both contents into frontmatter and body
-                def split_mdc_file(content: str) -> Tuple[str, str]:
-                    if content.startswith('---\n'):
-                        parts = content.split('---\n', 2)
-                        if len(parts) >= 3:
-                            return parts[1], parts[2]
-                    return '', content
-                
                 old_frontmatter, old_body = split_mdc_file(current_content)
                 new_frontmatter, new_body = split_mdc_file(final_content)
             
-                # Check if frontmatter changed
+                # Check which parts changed
                 frontmatter_changed = old_frontmatter != new_frontmatter
+                body_changed = old_body != new_body
                 
-                # Generate diffs for both parts
+                # Show frontmatter diff
                 if frontmatter_changed:
-                    # Show frontmatter diff
-                    frontmatter_diff = list(difflib.unified_diff(
-                        old_frontmatter.split('\n'),
-                        new_frontmatter.split('\n'),
-                        lineterm=''
-                    ))
-                    # Skip the first two lines (diff headers)
-                    for line in frontmatter_diff[2:]:
-                        if line.startswith('+'):
-                            summary += line + '\n'
-                        elif line.startswith('-'):
-                            summary += line + '\n'
-                        else:
-                            summary += ' ' + line[1:] + '\n'
-                
-                # Generate body diff
-                body_diff = list(difflib.unified_diff(
-                    old_body.split('\n'),
-                    new_body.split('\n'),
-                    lineterm=''
-                ))
+                    write_unified_diff(w, old_frontmatter, new_frontmatter)
                 
                 # If we have both frontmatter and body changes, add a skip indicator
-                if frontmatter_changed and len(body_diff) > 2:
-                    summary += " ...\n"
+                if frontmatter_changed and body_changed:
+                    w(" ...\n")
                 
                 # Show body diff if it exists
-                if len(body_diff) > 2:  # More than just the headers
-                    for line in body_diff[2:]:  # Skip the first two lines (diff headers)
-                        if line.startswith('+'):
-                            summary += line + '\n'
-                        elif line.startswith('-'):
-                            summary += line + '\n'
-                        else:
-                            summary += ' ' + line[1:] + '\n'
+                if body_changed:
+                    write_unified_diff(w, old_body, new_body)
                 
-                summary += "```\n"
+                w("```\n")
         
         if not state.is_applied:
-            summary += "\n**To apply these changes:**\n"
-            summary += "Add a new comment on this PR with the text `/apply-cursor-rules` and nothing else.\n"
+            w("\n**To apply these changes:**\n")
+            w("Add a new comment on this PR with the text `/apply-cursor-rules` and nothing else.\n")
             
         # Add the hidden state
-        summary += "\n<!--rule-changes\n"
-        summary += json.dumps({
+        w("\n<!--rule-changes\n")
+        w(json.dumps({
             "suggestions": [
                 {
                     "id": id,
@@ -310,12 +305,12 @@ def format_summary_comment(state: SummaryState, current_rules: List[CursorRule])
                 }
                 for id, output in state.suggestions
             ]
-        })
-        summary += "\n-->\n"
+        }))
+        w("\n-->\n")
     else:
-        summary += "No suggestions accepted yet.\n\n"
+        w("No suggestions accepted yet.\n\n")
     
     if not state.is_applied:
-        summary += "\nℹ️ Once rules are applied, no further rule suggestions will be added to this PR. Always double check the generated commit before merging."
+        w("\nℹ️ Once rules are applied, no further rule suggestions will be added to this PR. Always double check the generated commit before merging.")
     
-    return summary
\ No newline at end of file
+    return out.getvalue()
\ No newline at end of file
@@ -1,8 +1,16 @@
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, Optional, List, Set, Tuple
 from app.prompts import RuleGenerationOutput
-from github import Github
+from github import Github, GithubException
+from github.IssueComment import IssueComment
+from github.PullRequest import PullRequest
+from github.PullRequestComment import PullRequestComment
+import asyncio
+import itertools
 import logging
 import os
+import re
+import threading
+from urllib.parse import urlencode
 from fastapi import HTTPException
 
 from app.server_state import RecentSuggestion, get_state_manager
@@ -10,23 +18,62 @@ from .constants import (
     SUMMARY_SIGNATURE, SUGGESTION_SIGNATURE, APPLIED_SIGNATURE,
     BOT_APP_NAME, APPLY_COMMAND
 )
-from .models import SummaryState, Suggestion
+from .models import HiddenSummaryState, SummaryState, Suggestion
 from .formatters import format_suggestion_comment, format_summary_comment
-from .cursor_rules import CursorRule, get_current_rules, format_rules_for_llm
+from .cursor_rules import CursorRule, decode_github_content, get_current_rules, format_rules_for_llm, github_request_json
 from .llm import should_create_rule, generate_rule
 from github.Repository import Repository
-from functools import lru_cache
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import ThreadPoolExecutor
 import time
-import base64
-import json
 from .rule_applier import apply_rule_changes
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-# Cache for ETags
-etag_cache = {}
-comment_cache = {}
+# Cache for ETags: request URL -> (etag, response headers, response data)
+etag_cache = LRUCache(maxsize=1024)
+# cachetools caches aren't thread-safe and comment pages can be fetched concurrently
+etag_cache_lock = threading.Lock()
+# PR comments keyed by "owner/repo#number", revalidated with conditional requests on
+# every read so edits and deletions show up right away
+comment_cache = TTLCache(maxsize=512, ttl=300)
+# Cursor rules keyed by "owner/repo@sha"; a commit's rules never change
+rules_cache = TTLCache(maxsize=512, ttl=3600)
+# Rules are loaded from worker threads, so the cache needs a lock too
+rules_cache_lock = threading.Lock()
+# Thread root IDs that already have a suggestion: (comments they were derived from, IDs)
+thread_roots_cache = TTLCache(maxsize=512, ttl=300)
+# Source file lines keyed by "owner/repo@sha:path", used for review comment context
+file_lines_cache = LRUCache(maxsize=64)
+
+NEXT_LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="next"')
+# Hidden JSON payloads embedded in suggestion and summary comments
+RULE_OUTPUT_PATTERN = re.compile(r"<!--rule-generation-output(.*?)-->", re.DOTALL)
+HIDDEN_STATE_PATTERN = re.compile(r"<!--rule-changes\n(.*?)\n-->", re.DOTALL)
+THREAD_ROOT_PATTERN = re.compile(r"<!--thread-root-(\d+)-->")
+# Any of the bot's signatures, matched in a single scan of the comment body
+BOT_SIGNATURE_PATTERN = re.compile(
+    "|".join(re.escape(sig) for sig in (SUMMARY_SIGNATURE, SUGGESTION_SIGNATURE, APPLIED_SIGNATURE))
+)
+
+# Both comment lists for a PR in one round-trip; connections are capped at 100 nodes
+PR_COMMENTS_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      comments(first: 100) { totalCount nodes { databaseId body url } }
+      reviewThreads(first: 100) {
+        totalCount
+        nodes { comments(first: 100) { totalCount nodes { databaseId body url } } }
+      }
+    }
+  }
+}
+"""
+GRAPHQL_PAGE_SIZE = 100
+# GitHub caps comment bodies at 65536 bytes
+MAX_SUMMARY_BYTES = 60000
 
 def log_rate_limit(github_client: Github):
     """Log current rate limit status"""
@@ -53,73 +100,202 @@ def is_bot_comment(comment: Dict) -> bool:
 
 def is_suggestion_acceptance(comment: Dict) -> bool:
     """Check if this is someone accepting a suggestion by checking the box"""
-    return (
-        SUGGESTION_SIGNATURE in comment["body"]
-        and "[x]" in comment["body"]
-        and "Accept this suggestion?" in comment["body"]
-        and is_bot_comment(comment)
-    )
+    # The user type lookup is cheapest and rules out most comments, so it gates the body scans
+    if not is_bot_comment(comment):
+        return False
+    body = comment["body"]
+    return "[x]" in body and SUGGESTION_SIGNATURE in body and "Accept this suggestion?" in body
 
 def is_apply_command(comment: Dict) -> bool:
     """Check if this comment is the apply command.
-    The command must be the ONLY content of the comment, and it must not be in a summary comment."""
-    # Skip if this is a summary comment
-    if SUMMARY_SIGNATURE in comment["body"]:
-        return False
-        
-    # Command must be the only content (allowing for whitespace)
+    The command must be the ONLY content of the comment (allowing for whitespace), which
+    also rules out summary comments."""
     return comment["body"].strip() == APPLY_COMMAND
 
 def extract_rule_generation_output(comment_body: str) -> str:
     """Extract RuleGenerationOutput JSON from a suggestion comment"""
-    json_start = comment_body.find("<!--rule-generation-output") + len("<!--rule-generation-output")
-    json_end = comment_body.find("-->", json_start)
-    if json_start > len("<!--rule-generation-output") and json_end > json_start:
-        return comment_body[json_start:json_end].strip()
-    return ""
+    match = RULE_OUTPUT_PATTERN.search(comment_body)
+    return match.group(1).strip() if match else ""
+
+def get_with_etag(requester, url: str, parameters: Optional[Dict] = None) -> Tuple[Dict, object]:
+    """GET a GitHub API URL as a conditional request.
+    Sends If-None-Match with the last ETag seen for this URL (and If-Modified-Since
+    when the response had a Last-Modified header); on 304 Not Modified
+    the cached headers and data are returned (304s don't count against the rate limit)."""
+    cache_key = f"{url}?{urlencode(sorted(parameters.items()))}" if parameters else url
+    with etag_cache_lock:
+        cached = etag_cache.get(cache_key)
+    request_headers = None
+    if cached:
+        request_headers = {"If-None-Match": cached[0]}
+        # Token independent, so still validates after the installation token rotates
+        if cached[1].get("last-modified"):
+            request_headers["If-Modified-Since"] = cached[1]["last-modified"]
+    
+    status, headers, data = github_request_json(requester, url, parameters, request_headers)
+    if status == 304 and cached:
+        logger.debug(f"Not modified: {cache_key}")
+        return cached[1], cached[2]
+    
+    if headers.get("etag"):
+        with etag_cache_lock:
+            etag_cache[cache_key] = (headers["etag"], headers, data)
+    return headers, data
+
+def get_paginated_with_etag(requester, url: str, item_class) -> List:
+    """Fetch every page of a GitHub list endpoint with conditional requests,
+    wrapping each item in the given PyGithub class."""
+    items = []
+    next_url, parameters = url, {"per_page": 100}
+    while next_url:
+        headers, data = get_with_etag(requester, next_url, parameters)
+        items.extend(item_class(requester, headers, item, completed=True) for item in data or [])
+        # The next link already carries the query parameters
+        match = NEXT_LINK_PATTERN.search(headers.get("link", ""))
+        next_url, parameters = (match.group(1), None) if match else (None, None)
+    return items
+
+def get_pull_request(github_client: Github, repo_name: str, pr_number: int) -> PullRequest:
+    """Fetch a PR with a conditional request.
+    Skips the separate get_repo call, and reuses the cached PR payload when GitHub
+    answers 304. The ETag changes whenever the PR does (including its head SHA),
+    so a cached payload never carries a stale head."""
+    requester = github_client.requester
+    headers, data = get_with_etag(requester, f"/repos/{repo_name}/pulls/{pr_number}")
+    return PullRequest(requester, headers, data, completed=True)
+
+def get_comments_graphql(pr) -> Optional[Tuple[List, List]]:
+    """Fetch issue and review comments with a single GraphQL query.
+    Returns None if any connection has more than one page of nodes, or if the query
+    fails (errors in the response, a missing pull request, secondary rate limits),
+    so the caller can fall back to the paginated REST endpoints."""
+    owner, name = pr.base.repo.full_name.split("/", 1)
+    try:
+        _, data = pr.requester.graphql_query(
+            PR_COMMENTS_QUERY, {"owner": owner, "name": name, "number": pr.number}
+        )
+        pull = data["data"]["repository"]["pullRequest"]
+        comments, threads = pull["comments"], pull["reviewThreads"]
+        if (
+            comments["totalCount"] > GRAPHQL_PAGE_SIZE
+            or threads["totalCount"] > GRAPHQL_PAGE_SIZE
+            or any(t["comments"]["totalCount"] > GRAPHQL_PAGE_SIZE for t in threads["nodes"])
+        ):
+            return None
+        
+        # Map nodes onto the REST shapes downstream code reads (id, body, url for edits)
+        issues_url = f"{pr.base.repo.url}/issues/comments"
+        issue_comments = [
+            IssueComment(pr.requester, {}, {
+                "id": node["databaseId"], "body": node["body"],
+                "url": f"{issues_url}/{node['databaseId']}", "html_url": node["url"],
+            }, completed=True)
+            for node in comments["nodes"]
+        ]
+        review_url = f"{pr.base.repo.url}/pulls/comments"
+        review_comments = [
+            PullRequestComment(pr.requester, {}, {
+                "id": node["databaseId"], "body": node["body"],
+                "url": f"{review_url}/{node['databaseId']}", "html_url": node["url"],
+            }, completed=True)
+            for thread in threads["nodes"]
+            for node in thread["comments"]["nodes"]
+        ]
+    except (GithubException, KeyError, TypeError) as e:
+        logger.warning(f"GraphQL comment query failed for PR {get_pr_key(pr)}, using REST: {str(e)}")
+        return None
+    return issue_comments, review_comments
+
+def get_pr_key(pr) -> str:
+    """Stable "owner/repo#number" key for per-PR caches and state"""
+    return f"{pr.base.repo.full_name}#{pr.number}"
+
+def remember_summary_comment(pr, comment_id: int):
+    """Persist the summary comment ID so later webhooks can fetch it directly"""
+    state_manager = get_state_manager()
+    if state_manager.get_state().set_summary_comment_id(get_pr_key(pr), comment_id):
+        state_manager.save_state()
+
+def get_comments_rest(pr) -> Tuple[List, List]:
+    """Page through both REST comment lists with conditional requests, so every page
+    that hasn't changed since the last fetch is a 304 (free of rate limit)"""
+    # The two lists are independent, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        issue_future = executor.submit(get_paginated_with_etag, pr.requester, pr.comments_url, IssueComment)
+        review_future = executor.submit(get_paginated_with_etag, pr.requester, pr.review_comments_url, PullRequestComment)
+        return issue_future.result(), review_future.result()
+
+def same_comments(old: Tuple[List, List], new: Tuple[List, List]) -> bool:
+    """Check whether two fetches of a PR's comments hold the same IDs and bodies"""
+    return all(
+        len(old_list) == len(new_list)
+        and all(a.id == b.id and a.body == b.body for a, b in zip(old_list, new_list))
+        for old_list, new_list in zip(old, new)
+    )
 
-@lru_cache(maxsize=200)  # Increased cache size for multiple repos
 def get_cached_comments(pr) -> Tuple[List, List]:
-    """Cache PR comments to reduce API calls."""
-    pr_key = f"{pr.base.repo.full_name}#{pr.number}"
+    """Cache PR comments to reduce API calls.
+    Keyed by repo name and PR number rather than the PR object, which is rebuilt
+    on every webhook and would never produce a hit. A cached entry is revalidated
+    through the REST endpoints on every read, so comments users edited or deleted
+    are never served; while nothing changed the cached lists themselves come back."""
+    pr_key = get_pr_key(pr)
     cached = comment_cache.get(pr_key)
     
     if cached:
-        logger.debug(f"Using cached comments for PR {pr_key}")
-        return cached
-    
-    # Fetch new comments
-    issue_comments = list(pr.get_issue_comments())
-    review_comments = list(pr.get_review_comments())
-    result = (issue_comments, review_comments)
+        result = get_comments_rest(pr)
+        if same_comments(cached, result):
+            logger.debug(f"Cached comments for PR {pr_key} still current")
+            return cached
+        logger.debug(f"Comments for PR {pr_key} changed since they were cached")
+        thread_roots_cache.pop(pr_key, None)
+    else:
+        result = get_comments_graphql(pr)
+        if result is None:
+            # Too many comments for one query, or the query failed: page through REST,
+            # reusing the previous response for any page that hasn't changed
+            logger.debug(f"Fetching comments for PR {pr_key} through REST")
+            result = get_comments_rest(pr)
     
-    # Cache the results with timestamp
     comment_cache[pr_key] = result
     return result
 
 def invalidate_comment_cache(pr):
     """Invalidate comment cache for a specific PR"""
-    pr_key = f"{pr.base.repo.full_name}#{pr.number}"
+    pr_key = get_pr_key(pr)
     if pr_key in comment_cache:
         logger.debug(f"Invalidating comment cache for PR {pr_key}")
         del comment_cache[pr_key]
-    get_cached_comments.cache_clear()
+    thread_roots_cache.pop(pr_key, None)
 
 def find_or_create_summary(pr, create_if_missing: bool = False, current_rules: List[CursorRule] = None) -> Optional[Dict]:
-    """Find existing summary comment or create new one if requested"""
-    # Always invalidate cache before looking for summary to ensure fresh data
-    invalidate_comment_cache(pr)
+    """Find existing summary comment or create new one if requested.
+    Reads through the comment cache, which revalidates on every read; every write
+    path invalidates it, and edits update the cached comment object in place."""
+    pr_key = get_pr_key(pr)
+    
+    # Without warm cached comments, fetch the known summary comment on its own
+    # rather than paginating every comment on the PR
+    summary_id = get_state_manager().get_state().get_summary_comment_id(pr_key)
+    if summary_id and pr_key not in comment_cache:
+        try:
+            comment = pr.get_issue_comment(summary_id)
+            if SUMMARY_SIGNATURE in comment.body:
+                logger.debug(f"Fetched known summary comment #{comment.id}")
+                return comment
+        except GithubException as e:
+            # Deleted by a user; fall back to scanning
+            logger.debug(f"Known summary comment #{summary_id} unavailable ({e.status}), scanning comments")
+    
     issue_comments, _ = get_cached_comments(pr)
     
-    # More thorough check for existing summary
+    # More thorough check for existing summary. Plain str search: encoding each
+    # body to search bytes would cost more than the scan
     for comment in issue_comments:
-        try:
-            if isinstance(comment.body, str) and SUMMARY_SIGNATURE in comment.body:
-                logger.debug(f"Found existing summary comment #{comment.id}")
-                return comment
-        except AttributeError:
-            logger.debug(f"Skipping comment that doesn't have a body attribute")
-            continue
+        if SUMMARY_SIGNATURE in comment.body:
+            logger.debug(f"Found existing summary comment #{comment.id}")
+            remember_summary_comment(pr, comment.id)
+            return comment
             
     if create_if_missing:
         logger.info("No existing summary found, creating new one")
@@ -127,6 +303,7 @@ def find_or_create_summary(pr, create_if_missing: bool = False, current_rules: L
         summary = format_summary_comment(state, current_rules)
         new_comment = pr.create_issue_comment(summary)
         logger.debug(f"Created summary comment #{new_comment.id}")
+        remember_summary_comment(pr, new_comment.id)
         # Invalidate cache since we added a comment
         invalidate_comment_cache(pr)
         return new_comment
@@ -151,17 +328,13 @@ def parse_summary_state(summary_body: str) -> SummaryState:
         return state  # If it's applied, we're done - no need to parse suggestions
         
     # Extract hidden state
-    json_start = summary_body.find("<!--rule-changes\n") + len("<!--rule-changes\n")
-    json_end = summary_body.find("\n-->", json_start)
+    match = HIDDEN_STATE_PATTERN.search(summary_body)
     
-    if json_start > len("<!--rule-changes\n") and json_end > json_start:
+    if match:
         try:
-            hidden_state = json.loads(summary_body[json_start:json_end])
-            for suggestion in hidden_state["suggestions"]:
-                state.add_suggestion(
-                    suggestion["id"],
-                    RuleGenerationOutput.model_validate(suggestion["rule_generation_output"])
-                )
+            # Validate straight from the JSON text, without building intermediate dicts
+            hidden_state = HiddenSummaryState.model_validate_json(match.group(1))
+            state.suggestions = [(s.id, s.rule_generation_output) for s in hidden_state.suggestions]
         except Exception as e:
             logger.error(f"Failed to parse hidden state: {e}")
             # Continue with empty state
@@ -169,6 +342,24 @@ def parse_summary_state(summary_body: str) -> SummaryState:
     return state
 
 
+def get_file_lines(repo, ref: str, file_path: str) -> List[str]:
+    """Get a file's lines at a commit, cached so several review comments on the
+    same file only fetch and decode it once."""
+    cache_key = f"{repo.full_name}@{ref}:{file_path}"
+    cached = file_lines_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    file_contents = repo.get_contents(file_path, ref=ref)
+    if isinstance(file_contents, list):
+        logger.warning(f"File path {file_path} returned multiple contents, using first one")
+        file_contents = file_contents[0]
+    
+    lines = decode_github_content(file_contents.content).split('\n')
+    file_lines_cache[cache_key] = lines
+    return lines
+
+
 async def get_code_context(pr, comment: Dict, event_type: str) -> Optional[str]:
     """Get the code context for a comment if it's a review comment.
     For review comments, fetches:
@@ -187,13 +378,7 @@ async def get_code_context(pr, comment: Dict, event_type: str) -> Optional[str]:
         
         # Get the file content from the PR's head branch
         try:
-            file_contents = pr.base.repo.get_contents(file_path, ref=pr.head.sha)
-            if isinstance(file_contents, list):
-                logger.warning(f"File path {file_path} returned multiple contents, using first one")
-                file_contents = file_contents[0]
-            
-            file_content = base64.b64decode(file_contents.content).decode('utf-8')
-            lines = file_content.split('\n')
+            lines = get_file_lines(pr.base.repo, pr.head.sha, file_path)
             
             # Get 10 lines before and after, being careful of file boundaries
             start = max(0, line_num - 20)
@@ -217,34 +402,41 @@ async def get_code_context(pr, comment: Dict, event_type: str) -> Optional[str]:
 def get_root_comment_id(comment: Dict) -> int:
     """Get the ID of the root comment in a thread.
     If this comment is a reply, follow the chain up to find the original comment."""
-    # For review comments, in_reply_to points to the root comment
-    if "in_reply_to_id" in comment:
-        return comment["in_reply_to_id"]
-    # For issue comments, we need to check the parent
-    if "parent" in comment and comment["parent"]:
-        return comment["parent"]["id"]
-    return comment["id"]
+    # For review comments, in_reply_to points to the root comment; for issue
+    # comments, we need to check the parent
+    return (
+        comment.get("in_reply_to_id")
+        or (comment.get("parent") or {}).get("id")
+        or comment["id"]
+    )
+
+def get_handled_thread_roots(pr) -> Set[int]:
+    """Get the thread root IDs the bot has already posted suggestions for.
+    Built once per set of comments, so repeated checks are set lookups."""
+    pr_key = get_pr_key(pr)
+    comments = get_cached_comments(pr)
+    cached = thread_roots_cache.get(pr_key)
+    if cached is not None and cached[0] is comments:
+        return cached[1]
+    
+    issue_comments, review_comments = comments
+    handled = set()
+    for comment in itertools.chain(issue_comments, review_comments):
+        # Suggestion comments always put the signature before the thread marker
+        signature_pos = comment.body.find(SUGGESTION_SIGNATURE)
+        if signature_pos != -1:
+            handled.update(int(root_id) for root_id in THREAD_ROOT_PATTERN.findall(comment.body, signature_pos))
+    
+    thread_roots_cache[pr_key] = (comments, handled)
+    return handled
 
 def has_existing_suggestion(pr, thread_root_id: int) -> bool:
     """Check if we've already made a suggestion for this comment thread"""
     try:
-        marker = f"<!--thread-root-{thread_root_id}-->"
         logger.debug(f"Looking for marker for thread root #{thread_root_id}")
-        
-        # Use cached comments
-        issue_comments, review_comments = get_cached_comments(pr)
-        
-        # Check all PR comments
-        for comment in issue_comments:
-            if SUGGESTION_SIGNATURE in comment.body and marker in comment.body:
-                logger.debug(f"Found existing suggestion in issue comment #{comment.id} for thread root #{thread_root_id}")
-                return True
-                
-        # Check review comments if needed
-        for comment in review_comments:
-            if SUGGESTION_SIGNATURE in comment.body and marker in comment.body:
-                logger.debug(f"Found existing suggestion in review comment #{comment.id} for thread root #{thread_root_id}")
-                return True
+        if thread_root_id in get_handled_thread_roots(pr):
+            logger.debug(f"Found existing suggestion for thread root #{thread_root_id}")
+            return True
                 
         logger.debug(f"No existing suggestion found for thread root #{thread_root_id}")
         return False
@@ -252,40 +444,44 @@ def has_existing_suggestion(pr, thread_root_id: int) -> bool:
         logger.error(f"Error checking for existing suggestions: {str(e)}")
         return False  # Fail safe - better to potentially duplicate than miss
 
-@lru_cache(maxsize=200)  # Increased for multiple repos
 def get_cached_rules(repo, ref: str) -> List[CursorRule]:
-    """Cache cursor rules to reduce API calls."""
+    """Cache cursor rules to reduce API calls, keyed by repo name and ref.
+    Blocking (retries sleep on rate limits), so async code runs it in a worker thread."""
     cache_key = f"{repo.full_name}@{ref}"
-    cached = comment_cache.get(cache_key)
+    with rules_cache_lock:
+        cached = rules_cache.get(cache_key)
     
-    if cached:
+    if cached is not None:
         logger.debug(f"Using cached rules for {cache_key}")
         return cached
     
     # Fetch new rules
     rules = get_current_rules(repo, ref=ref)
-    comment_cache[cache_key] = rules
+    with rules_cache_lock:
+        rules_cache[cache_key] = rules
     return rules
 
 def clear_caches():
     """Clear all caches - useful if data gets stale"""
-    get_cached_comments.cache_clear()
-    get_cached_rules.cache_clear()
     comment_cache.clear()
+    thread_roots_cache.clear()
+    with rules_cache_lock:
+        rules_cache.clear()
+    etag_cache.clear()
+    file_lines_cache.clear()
     logger.info("All caches cleared")
 
 def update_suggestion_status(state_manager, suggestion_id: str, status: str, comment_url: Optional[str] = None):
     """Update the status of an existing suggestion"""
-    state = state_manager.get_state()
-    for suggestion in state.recent_suggestions:
-        if suggestion.id == suggestion_id:
-            suggestion.status = status
-            if comment_url:
-                suggestion.comment_url = comment_url
-            state_manager.save_state()
-            logger.info(f"Updated suggestion {suggestion_id} status to {status}")
-            return True
-    return False
+    suggestion = state_manager.get_state().get_suggestion(suggestion_id)
+    if suggestion is None:
+        return False
+    suggestion.status = status
+    if comment_url:
+        suggestion.comment_url = comment_url
+    state_manager.save_state()
+    logger.info(f"Updated suggestion {suggestion_id} status to {status}")
+    return True
 
 async def handle_suggestion_acceptance(
     pr,
@@ -307,8 +503,8 @@ async def handle_suggestion_acceptance(
         logger.error(f"Failed to parse rule generation output: {e}")
         raise HTTPException(status_code=400, detail="Invalid rule generation output format")
     
-    # Get current rules
-    current_rules = get_cached_rules(pr.base.repo, pr.head.sha)
+    # Get current rules. Off the event loop, since rate limit retries sleep
+    current_rules = await asyncio.to_thread(get_cached_rules, pr.base.repo, pr.head.sha)
     
     # Get or create summary comment
     if not summary_comment:
@@ -324,22 +520,18 @@ async def handle_suggestion_acceptance(
         logger.error(f"Trying to accept suggestion but summary is already applied! Summary: {summary_comment.body[:200]}...")
         return {"message": "Rules already applied"}
     
-    # Create a test state to check size
-    test_state = state.copy()
-    test_state.add_suggestion(comment["id"], rule_output)
+    # Add the suggestion and render the summary once; it's only posted if it fits
+    state.add_suggestion(comment["id"], rule_output)
+    summary = format_summary_comment(state, current_rules)
     
-    # Generate test summary and check size
-    test_summary = format_summary_comment(test_state, current_rules)
-    if len(test_summary.encode('utf-8')) > 60000:  # Leave ~5KB buffer for safety
+    # Check size, leaving ~5KB buffer for safety. UTF-8 uses at most 4 bytes per
+    # character, so short summaries can skip the encode entirely
+    if len(summary) * 4 > MAX_SUMMARY_BYTES and len(summary.encode('utf-8')) > MAX_SUMMARY_BYTES:
         return {
             "message": "Cannot accept suggestion: Summary comment would exceed GitHub's size limit. Please apply current suggestions before adding more."
         }
     
-    # If we get here, size is ok - proceed with real update
-    state.add_suggestion(comment["id"], rule_output)
-    
-    # Update the comment
-    summary = format_summary_comment(state, current_rules)
+    # If we get here, size is ok - update the comment
     summary_comment.edit(summary)
     
     # Find the original suggestion in our state to update its status
@@ -371,7 +563,7 @@ async def handle_new_suggestion(
     logger.debug(f"Handling potential new suggestion for comment #{comment.get('id')}")
     
     # First check if this is a bot comment or contains our signatures
-    if any(sig in comment["body"] for sig in [SUMMARY_SIGNATURE, SUGGESTION_SIGNATURE, APPLIED_SIGNATURE]):
+    if BOT_SIGNATURE_PATTERN.search(comment["body"]):
         logger.debug("Skipping suggestion for comment containing bot signatures")
         return {"message": "Skipping bot comment"}
     
@@ -379,9 +571,6 @@ async def handle_new_suggestion(
     thread_root_id = get_root_comment_id(comment)
     logger.debug(f"Identified thread root comment ID: {thread_root_id}")
     
-    # Invalidate cache before checking for existing suggestions
-    invalidate_comment_cache(pr)
-    
     # Check if we've already made a suggestion for this thread
     if has_existing_suggestion(pr, thread_root_id):
         logger.info(f"Skipping duplicate suggestion for thread root #{thread_root_id}")
@@ -396,8 +585,8 @@ async def handle_new_suggestion(
         logger.info(f"Initial filter rejected comment: {analysis.reason}")
         return {"message": "Comment does not need a rule suggestion"}
     
-    # Get existing rules for context
-    current_rules = get_cached_rules(pr.base.repo, pr.head.sha)
+    # Get existing rules for context. Off the event loop, since rate limit retries sleep
+    current_rules = await asyncio.to_thread(get_cached_rules, pr.base.repo, pr.head.sha)
     rules_context = format_rules_for_llm(current_rules)
 
     # SECOND STAGE: Thorough analysis and potential rule generation
@@ -509,12 +698,22 @@ async def handle_apply_command(
         
         try:
             # First attempt to apply the changes
-            results = apply_rule_changes(pr, state)
+            # In a worker thread: reading the rules can sleep on rate limit retries
+            results = await asyncio.to_thread(apply_rule_changes, pr, state)
+            if not results["changed"]:
+                # Nothing was committed, so leave the state un-applied
+                logger.warning("Accepted suggestions leave every rule file unchanged, nothing to apply")
+                return {
+                    "message": "No changes to apply: the accepted suggestions leave the rules unchanged",
+                    "commits": results,
+                    "status_updates": 0
+                }
             
             # If successful, mark as applied in summary
             logger.info("Setting state to applied via apply command")
             state.is_applied = True
-            summary = format_summary_comment(state, get_cached_rules(pr.base.repo, pr.head.sha))
+            current_rules = await asyncio.to_thread(get_cached_rules, pr.base.repo, pr.head.sha)
+            summary = format_summary_comment(state, current_rules)
             summary_comment.edit(summary)
             
             # Update all suggestion statuses to applied
@@ -569,8 +768,7 @@ async def handle_pr_comment(
         logger.info(f"Processing {event_type} comment on PR #{pr_number} in {repo_name}")
         log_rate_limit(github_client)  # Log rate limit at start
         
-        repo = github_client.get_repo(repo_name)
-        pr = repo.get_pull(pr_number)
+        pr = get_pull_request(github_client, repo_name, pr_number)
 
         # Check for apply command first
         if is_apply_command(comment):
@@ -1,18 +1,34 @@
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List
+from functools import cached_property
 from langchain_anthropic import ChatAnthropic
-from langchain.prompts import PromptTemplate
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+from cachetools import TTLCache
+from pydantic import BaseModel
+import anthropic
+import asyncio
+import hashlib
 import os
 import logging
 from .prompts import (
     RuleAnalysisOutput,
     RuleGenerationOutput,
     RuleChange,
-    ANALYSIS_PROMPT,
-    GENERATION_PROMPT
+    ANALYSIS_PROMPT_PREFIX,
+    GENERATION_PROMPT_PREFIX,
+    render_analysis_suffix,
+    render_generation_suffix
 )
 
 logger = logging.getLogger(__name__)
 
+# Optional aiohttp transport for the Anthropic client (anthropic[aiohttp] extra)
+try:
+    import httpx_aiohttp  # noqa: F401
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
 # Configure logging
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
@@ -20,22 +36,90 @@ logging.getLogger("httpcore").setLevel(logging.WARNING)
 # Environment variables for API keys
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
+# LLM results keyed by a hash of the normalized prompt inputs. Review comments like
+# "please add tests" repeat across PRs, and a hit skips a full model round-trip.
+analysis_cache = TTLCache(maxsize=1024, ttl=24 * 3600)
+generation_cache = TTLCache(maxsize=256, ttl=24 * 3600)
+
+def prompt_cache_key(*parts: str) -> str:
+    """Hash prompt inputs verbatim; indentation in code and rule contexts changes the answer"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# Model calls currently running, keyed like the caches. Concurrent identical requests
+# (GitHub redelivering a webhook, or a comment edited while it's being analyzed) join
+# the running call instead of starting another.
+_in_flight: Dict[str, asyncio.Future] = {}
+
+async def invoke_cached(chain, cache: TTLCache, kind: str, inputs: Dict[str, str]) -> BaseModel:
+    """Invoke a chain through its result cache, coalescing concurrent identical calls"""
+    # Only the comment's whitespace is normalized, so reformatted but otherwise identical
+    # comments share an entry
+    key_inputs = {**inputs, "comment": " ".join(inputs["comment"].split())}
+    cache_key = prompt_cache_key(kind, *key_inputs.values())
+    cached = cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Using cached {kind} result for identical inputs")
+        return cached.model_copy(deep=True)
+    
+    pending = _in_flight.get(cache_key)
+    if pending is None:
+        pending = asyncio.ensure_future(chain.ainvoke(inputs))
+        _in_flight[cache_key] = pending
+        pending.add_done_callback(lambda _: _in_flight.pop(cache_key, None))
+    else:
+        logger.info(f"Joining in-flight {kind} call for identical inputs")
+    
+    # Shielded so one caller being cancelled doesn't cancel the call for the others
+    result = await asyncio.shield(pending)
+    cache[cache_key] = result
+    return result.model_copy(deep=True)
+
+def cached_prefix_template(prefix: str, render_suffix: Callable[..., str]) -> RunnableLambda:
+    """Build a single-message prompt whose static prefix is marked for Anthropic prompt
+    caching. Cached input tokens are billed at a tenth of the normal rate, and the
+    prefix (plus the structured output tool schema before it) is identical on every call.
+    
+    The prefix is rendered once here; each call only joins the short suffix."""
+    prefix_text = prefix.format()  # Unescapes the doubled braces
+    
+    def render(inputs: Dict[str, str]) -> List[HumanMessage]:
+        return [HumanMessage(content=[
+            {"type": "text", "text": prefix_text, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": render_suffix(**inputs)},
+        ])]
+    
+    return RunnableLambda(render)
+
 # Define your prompt templates
-analysis_template = PromptTemplate(
-    template=ANALYSIS_PROMPT,
-    input_variables=["comment", "context"]
-)
+analysis_template = cached_prefix_template(ANALYSIS_PROMPT_PREFIX, render_analysis_suffix)
+generation_template = cached_prefix_template(GENERATION_PROMPT_PREFIX, render_generation_suffix)
 
-generation_template = PromptTemplate(
-    template=GENERATION_PROMPT,
-    input_variables=["comment", "context", "rules"]
-)
+class AioHttpChatAnthropic(ChatAnthropic):
+    """ChatAnthropic whose async calls go through aiohttp rather than httpx.
+    httpx's async pool degrades under many concurrent requests, which is exactly the
+    webhook burst case; aiohttp keeps pooled keep-alive connections instead."""
+
+    @cached_property
+    def _async_client(self) -> anthropic.AsyncClient:
+        client_params = self._client_params
+        http_client_params = {"base_url": client_params["base_url"]}
+        if "timeout" in client_params:
+            http_client_params["timeout"] = client_params["timeout"]
+        return anthropic.AsyncClient(
+            **client_params,
+            http_client=anthropic.DefaultAioHttpClient(**http_client_params)
+        )
 
 def get_llm():
     """Initialize and return the appropriate LLM based on available API keys"""
     if ANTHROPIC_API_KEY:
         logger.info("Using Anthropic Claude 3.7 Sonnet")
-        return ChatAnthropic(
+        llm_class = AioHttpChatAnthropic if AIOHTTP_AVAILABLE else ChatAnthropic
+        return llm_class(
             model="claude-3-7-sonnet-20250219",
             anthropic_api_key=ANTHROPIC_API_KEY,
             temperature=0
@@ -57,9 +141,15 @@ try:
     
 except Exception as e:
     logger.error(f"Failed to initialize LLM: {str(e)}")
+    base_llm = None
     analysis_chain = None
     generation_chain = None
 
+async def close_llm_clients():
+    """Close the async client's pooled connections, if it was ever created"""
+    if base_llm is not None and "_async_client" in base_llm.__dict__:
+        await base_llm._async_client.close()
+
 async def should_create_rule(
     comment_body: str,
     code_context: Optional[str] = None
@@ -76,7 +166,7 @@ async def should_create_rule(
     context = f"Additional code context:\n{code_context}" if code_context else "No additional code context provided."
     
     try:
-        return await analysis_chain.ainvoke({
+        return await invoke_cached(analysis_chain, analysis_cache, "analysis", {
             "comment": comment_body,
             "context": context
         })
@@ -100,7 +190,8 @@ async def generate_rule(
     context = f"Code context:\n{code_context}" if code_context else "No code context provided."
     
     try:
-        return await generation_chain.ainvoke({
+        # The existing rules are part of the key, so a changed rule set is a miss
+        return await invoke_cached(generation_chain, generation_cache, "generation", {
             "comment": comment_body,
             "context": context,
             "rules": rules_context
@@ -122,21 +213,21 @@ def apply_rule_changes(current_content: str, changes: List[RuleChange]) -> str:
             result = change.content
             continue
             
-        # For existing files, validate context
-        context_lines = change.context.strip().split('\n')
-        if len(context_lines) != 2:
-            raise ValueError(f"Context must be exactly 2 lines, got: {len(context_lines)}")
+        # For existing files, validate context (counting newlines, without splitting)
+        context_line_count = change.context.strip().count('\n') + 1
+        if context_line_count != 2:
+            raise ValueError(f"Context must be exactly 2 lines, got: {context_line_count}")
             
         if change.type == "addition":
             # Find where to add the new content
             context_pos = result.find(change.context)
             if context_pos == -1:
                 # If context not found, append to end
-                result += f"\n\n{change.content}"
+                result = "".join((result, "\n\n", change.content))
             else:
-                # Add after the context
+                # Add after the context, building the new string in one allocation
                 context_end = context_pos + len(change.context)
-                result = result[:context_end] + f"\n{change.content}" + result[context_end:]
+                result = "".join((result[:context_end], "\n", change.content, result[context_end:]))
                 
         elif change.type == "replacement":
             # Replace the context with the new content
@@ -1,20 +1,25 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from github import Github, GithubIntegration
+from github import Auth, Github, GithubIntegration
 from dotenv import load_dotenv
+from collections import defaultdict
+import asyncio
 import hmac
 import hashlib
 import logging
-import json
+import orjson
 import traceback
 import uvicorn
 import os
+import time
 from .constants import APP_ID, PRIVATE_KEY, WEBHOOK_SECRET, APPLY_COMMAND, SUMMARY_SIGNATURE, SUGGESTION_SIGNATURE
 from .handlers import handle_pr_comment, is_apply_command
+from .cursor_rules import MAX_CONCURRENT_GITHUB_CALLS
+from .llm import close_llm_clients
 from .server_state import get_state_manager, ServerMode, RecentSuggestion, ConnectedRepository
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import DefaultDict, Dict, List, Optional, Tuple
 from datetime import datetime
 
 # Set up logging
@@ -44,6 +49,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Release pooled HTTP connections"""
+    await close_llm_clients()
+
 # Initialize GitHub App integration if credentials exist
 github_integration = None
 if all([APP_ID, PRIVATE_KEY, WEBHOOK_SECRET]):
@@ -55,6 +65,71 @@ if all([APP_ID, PRIVATE_KEY, WEBHOOK_SECRET]):
 else:
     logger.info("GitHub App credentials not found - running in setup mode")
 
+# Installation tokens keyed by installation ID: (token, expires_at timestamp).
+# GitHub issues them for an hour, so most webhooks can skip the token request.
+TOKEN_REFRESH_MARGIN = 60  # Refresh this many seconds before expiry
+_installation_tokens: Dict[int, Tuple[str, float]] = {}
+_installation_token_locks: DefaultDict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+async def get_installation_token(installation_id: int) -> str:
+    """Get an access token for an installation, reusing it until it nearly expires"""
+    cached = _installation_tokens.get(installation_id)
+    if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+        return cached[0]
+    
+    # One refresh per installation at a time; concurrent webhooks wait for it
+    async with _installation_token_locks[installation_id]:
+        cached = _installation_tokens.get(installation_id)
+        if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+            return cached[0]
+        
+        # get_access_token blocks on an HTTPS request, so keep it off the event loop
+        access_token = await asyncio.to_thread(github_integration.get_access_token, installation_id)
+        _installation_tokens[installation_id] = (access_token.token, access_token.expires_at.timestamp())
+        return access_token.token
+
+# Webhook events the bot acts on; anything else is acknowledged without reading the body
+HANDLED_EVENTS = frozenset({"pull_request_review_comment", "issue_comment"})
+
+# Github clients keyed by installation ID: (client, token it was built with). Reusing
+# the client keeps its HTTP session, so webhooks skip a fresh TCP + TLS handshake.
+_installation_clients: Dict[int, Tuple[Github, str]] = {}
+
+async def get_github_client(installation_id: int) -> Github:
+    """Get a Github client for an installation, rebuilt only when its token rotates"""
+    token = await get_installation_token(installation_id)
+    cached = _installation_clients.get(installation_id)
+    if cached and cached[1] == token:
+        return cached[0]
+    
+    client = Github(
+        auth=Auth.Token(token),
+        per_page=100,
+        pool_size=MAX_CONCURRENT_GITHUB_CALLS  # Enough connections for parallel fetches
+    )
+    _installation_clients[installation_id] = (client, token)
+    if cached:
+        # Release the old client's connection pool. A webhook still using it just
+        # opens a new connection on its next call, until its token expires.
+        cached[0].close()
+    return client
+
+# Encoded once rather than on every webhook
+WEBHOOK_SECRET_BYTES = WEBHOOK_SECRET.encode() if WEBHOOK_SECRET else b""
+
+def verify_signature(signature: str, body: bytes) -> bool:
+    """Check an X-Hub-Signature-256 header against the body.
+    Compares the raw 32-byte digests rather than their hex encodings."""
+    prefix, _, signature_hex = signature.partition("=")
+    if prefix != "sha256":
+        return False
+    try:
+        signature_bytes = bytes.fromhex(signature_hex)
+    except ValueError:
+        return False
+    expected = hmac.new(WEBHOOK_SECRET_BYTES, body, hashlib.sha256).digest()
+    return hmac.compare_digest(signature_bytes, expected)
+
 # Add new API models
 class ServerModeUpdate(BaseModel):
     is_disabled: Optional[bool] = None
@@ -69,7 +144,7 @@ async def get_server_state():
     state_manager = get_state_manager()
     state = state_manager.get_state()
     return {
-        "mode": state.mode.model_dump(),
+        "mode": state_manager.get_mode_dict(),
         "repositories": len(state.repositories),
         "recent_suggestions": len(state.recent_suggestions),
         "setup_complete": github_integration is not None
@@ -98,7 +173,8 @@ async def get_repositories():
     
     state_manager = get_state_manager()
     state = state_manager.get_state()
-    return {"repositories": list(state.repositories.values())}
+    # Pre-serialized, so polling doesn't re-encode every repository each time
+    return Response(content=state.get_repositories_json(), media_type="application/json")
 
 @app.patch("/api/mode")
 async def update_mode(mode: ServerModeUpdate):
@@ -122,10 +198,15 @@ async def update_repository(full_name: str, update: RepositoryUpdate):
     state_manager = get_state_manager()
     state = state_manager.get_state()
     
-    if state.set_repository_enabled(full_name, update.enabled):
+    repo = state.get_repository(full_name)
+    if repo is None:
+        raise HTTPException(status_code=404, detail="Repository not found")
+    
+    # Only persist when the setting actually changes
+    if repo.enabled != update.enabled:
+        state.set_repository_enabled(full_name, update.enabled)
         state_manager.save_state()
-        return {"message": f"Repository {full_name} {'enabled' if update.enabled else 'disabled'}"}
-    raise HTTPException(status_code=404, detail="Repository not found")
+    return {"message": f"Repository {full_name} {'enabled' if update.enabled else 'disabled'}"}
 
 @app.post("/webhook")
 async def webhook(request: Request):
@@ -144,7 +225,7 @@ async def webhook(request: Request):
         logger.info("Server is disabled, skipping webhook processing")
         return {
             "message": "Server is disabled",
-            "mode": state.mode.model_dump()
+            "mode": state_manager.get_mode_dict()
         }
     
     # Verify webhook signature
@@ -153,35 +234,30 @@ async def webhook(request: Request):
         logger.error("Missing webhook signature")
         raise HTTPException(status_code=401, detail="No signature")
     
+    # Check the event type from its header first, so events we never handle
+    # don't pay for reading, verifying and parsing their payload
+    event_type = request.headers.get("X-GitHub-Event")
+    if not event_type:
+        logger.error("Missing event type header")
+        raise HTTPException(status_code=400, detail="No event type")
+    
+    if event_type not in HANDLED_EVENTS:
+        logger.info(f"Ignoring unsupported event type: {event_type}")
+        return {"message": f"Event type {event_type} not handled"}
+    
     body = await request.body()
     logger.debug(f"Webhook body size: {len(body)} bytes")
     
-    expected = "sha256=" + hmac.new(
-        WEBHOOK_SECRET.encode(),
-        body,
-        hashlib.sha256
-    ).hexdigest()
-    
-    if not hmac.compare_digest(signature, expected):
+    if not verify_signature(signature, body):
         logger.error("Invalid webhook signature")
         raise HTTPException(status_code=401, detail="Invalid signature")
     
-    # Parse event
-    event_type = request.headers.get("X-GitHub-Event")
-    if not event_type:
-        logger.error("Missing event type header")
-        raise HTTPException(status_code=400, detail="No event type")
-    
     logger.info(f"Processing {event_type} event")
-    data = json.loads(body)
-    
-    # Get installation token
-    installation_id = data["installation"]["id"]
-    logger.info(f"Getting token for installation {installation_id}")
-    access_token = github_integration.get_access_token(installation_id)
-    github_client = Github(access_token.token)
+    # Parse the bytes already read for the signature check
+    data = orjson.loads(body)
     
     # Get repository info
+    installation_id = data["installation"]["id"]
     repo_name = data["repository"]["full_name"]
     
     # Always track repository activity, even if disabled
@@ -196,7 +272,8 @@ async def webhook(request: Request):
             last_active=datetime.utcnow(),
             enabled=True  # New repositories are enabled by default
         ))
-        state_manager.save_state()
+    # Saves are debounced, so persisting activity on every webhook is cheap
+    state_manager.save_state()
     
     # Check if repository is enabled
     if not state.is_repository_enabled(repo_name):
@@ -206,40 +283,36 @@ async def webhook(request: Request):
             "repository": repo_name
         }
     
-    # Process the event based on type
+    # Process the event
     try:
-        if event_type == "pull_request_review_comment" or event_type == "issue_comment":
-            logger.info(f"Processing {event_type} on {repo_name}")
-            
-            # Skip if the action is 'deleted'
-            if data.get("action") == "deleted":
-                logger.info(f"Ignoring deleted {event_type}")
-                return {"message": "Ignoring deleted comment"}
-            
-            # Extract PR number based on event type
-            if event_type == "pull_request_review_comment":
-                pr_number = data["pull_request"]["number"]
-            else:  # issue_comment
-                # For issue comments, we need to check if it's on a PR
-                if "pull_request" not in data["issue"]:
-                    logger.info("Ignoring issue comment not on a PR")
-                    return {"message": "Comment is not on a PR"}
-                pr_number = data["issue"]["number"]
-            
-            # Process the comment with dry run mode if enabled
-            result = await handle_pr_comment(github_client, data, dry_run=state.mode.dry_run)
-            
-            # If in dry run mode, add mode info to response
-            if state.mode.dry_run:
-                result = {
-                    **result,
-                    "mode": state.mode.model_dump()
-                }
-            
-            return result
+        logger.info(f"Processing {event_type} on {repo_name}")
         
-        logger.info(f"Ignoring unsupported event type: {event_type}")
-        return {"message": f"Event type {event_type} not handled"}
+        # Skip if the action is 'deleted'. Edits are still processed, since
+        # checking a suggestion's box arrives as an edited comment
+        if data.get("action") == "deleted":
+            logger.info(f"Ignoring deleted {event_type}")
+            return {"message": "Ignoring deleted comment"}
+        
+        # For issue comments, we need to check if it's on a PR
+        if event_type == "issue_comment" and "pull_request" not in data["issue"]:
+            logger.info("Ignoring issue comment not on a PR")
+            return {"message": "Comment is not on a PR"}
+        
+        # Only now is an authenticated client needed
+        logger.info(f"Getting token for installation {installation_id}")
+        github_client = await get_github_client(installation_id)
+        
+        # Process the comment with dry run mode if enabled
+        result = await handle_pr_comment(github_client, data, dry_run=state.mode.dry_run)
+        
+        # If in dry run mode, add mode info to response
+        if state.mode.dry_run:
+            result = {
+                **result,
+                "mode": state_manager.get_mode_dict()
+            }
+        
+        return result
     
     except Exception as e:
         logger.error(f"Error processing webhook: {traceback.format_exc()}")
@@ -276,4 +349,5 @@ if os.path.exists(frontend_path):
 
 if __name__ == "__main__":
     logger.info("Starting Cursor Rules Bot server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # "auto" picks uvloop and httptools when installed (uvicorn[standard])
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto") 
\ No newline at end of file
@@ -8,6 +8,15 @@ class Suggestion(BaseModel):
     yaml_content: str
     is_accepted: bool = False
     
+class HiddenSuggestion(BaseModel):
+    """One accepted suggestion as stored in the summary comment's hidden state"""
+    id: int
+    rule_generation_output: RuleGenerationOutput
+
+class HiddenSummaryState(BaseModel):
+    """The hidden JSON state embedded in the summary comment"""
+    suggestions: List[HiddenSuggestion]
+
 class SummaryState(BaseModel):
     """The current state of suggestions in a PR"""
     suggestions: List[Tuple[int, RuleGenerationOutput]]
@@ -19,7 +28,9 @@ class SummaryState(BaseModel):
         
     def remove_suggestion(self, suggestion_id: int) -> None:
         """Remove a suggestion by ID"""
-        self.suggestions = [(id, output) for id, output in self.suggestions if id != suggestion_id]
+        # Only rebuild the list when there's something to remove
+        if any(id == suggestion_id for id, _ in self.suggestions):
+            self.suggestions = [(id, output) for id, output in self.suggestions if id != suggestion_id]
         
     def is_empty(self) -> bool:
         """Check if there are any suggestions"""
@@ -27,7 +38,6 @@ class SummaryState(BaseModel):
         
     def copy(self) -> 'SummaryState':
         """Create a copy of the current state"""
-        return SummaryState(
-            suggestions=self.suggestions.copy(),
-            is_applied=self.is_applied
-        ) 
\ No newline at end of file
+        # model_copy skips re-validating every suggestion; the list itself is copied
+        # so adding to the copy leaves this state untouched
+        return self.model_copy(update={"suggestions": list(self.suggestions)}) 
\ No newline at end of file
@@ -1,13 +1,15 @@
-from typing import List, Literal, Union, Optional
-from pydantic import BaseModel, Field, model_validator
+from typing import List, Literal, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 class RuleAnalysisOutput(BaseModel):
     """Output schema for the first stage LLM call that decides if a comment deserves a rule"""
+    model_config = ConfigDict(frozen=True)
     should_create_rule: bool = Field(description="Whether this comment deserves a cursor rule")
     reason: str = Field(description="Detailed explanation of why this comment does or doesn't deserve a rule. Should be no more than 1 sentence.")
 
 class RuleChange(BaseModel):
     """Represents a change to a cursor rule file"""
+    model_config = ConfigDict(frozen=True)
     type: Literal["addition", "replacement"] = Field(description="The type of change to make")
     content: str = Field(description="The new content to add or the replacement content. Don't ever include the globs or description in the content field.")
     text_to_replace: Optional[str] = Field(description="For a replacement operation, the full text that should be fully replaced by the content field. Not needed for additions.", default=None)
@@ -22,10 +24,13 @@ class RuleChange(BaseModel):
     def check_new_file_fields(self) -> 'RuleChange':
         """Validate that new files have required fields and existing file modifications don't"""
         if self.is_new_file:
-            if not self.file_globs or not self.file_description:
+            if not (self.file_globs and self.file_description):
                 raise ValueError("New files must specify both file_globs and file_description")
             if self.existing_content_context or self.text_to_replace:
                 raise ValueError("existing_content_context and text_to_replace should not be used with new files")
+        elif self.text_to_replace or self.type == "addition":
+            # The common case (an edit to an existing file) is settled by one check
+            return self
         
         if self.type == "replacement" and not self.text_to_replace:
             raise ValueError("text_to_replace is required for replacement operations")
@@ -34,11 +39,13 @@ class RuleChange(BaseModel):
 
 class RuleGenerationOutput(BaseModel):
     """Output schema for the second stage LLM call that generates the rule YAML"""
+    # LLM output is produced once and only read afterwards
+    model_config = ConfigDict(frozen=True)
     should_generate: bool = Field(description="Whether we should proceed with generating/updating a rule")
     reason: str = Field(description="Explanation of why we should or shouldn't generate/update a rule. At most one sentence.")
     operation: Optional[Literal["update", "create"]] = Field(description="The type of operation to perform on the rule file", default=None)
     file_path: Optional[str] = Field(description="The path to the rule file being modified, required for update operations. ALWAYS prefixed with .cursor/rules/", default=None)
-    changes: List[RuleChange] = Field(description="List of changes to make to the rules")
+    changes: Tuple[RuleChange, ...] = Field(description="List of changes to make to the rules")
 
     @model_validator(mode='after')
     def validate_operation_fields(self) -> 'RuleGenerationOutput':
@@ -48,7 +55,8 @@ class RuleGenerationOutput(BaseModel):
         return self
 
 # Modular prompt components
-# These components can be reused across different prompts
+# These components can be reused across different prompts. They're stripped so the
+# surrounding prompts control the spacing and no blank lines go to the model.
 
 RULE_CRITERIA = """
 IMPORTANT: A comment must meet ALL of these criteria to be considered:
@@ -56,7 +64,7 @@ IMPORTANT: A comment must meet ALL of these criteria to be considered:
 2. Represents a CURRENT practice or Future Possibility. No temporary practices. 
 3. Can be clearly applied across multiple files/contexts
 4. Contains specific, actionable guidance
-"""
+""".strip()
 
 RULE_REJECTION_CRITERIA = """
 Comments that should be IMMEDIATELY REJECTED:
@@ -69,7 +77,7 @@ Comments that should be IMMEDIATELY REJECTED:
 - Comments about code that won't be repeated elsewhere
 - Obvious programming practices that don't need enforcement
 - Temporary practices that are not going to be permanent parts of the codebase
-"""
+""".strip()
 
 RULE_STRUCTURE_GUIDELINES = """
 Sections in a rules file should follow this structure:
@@ -84,7 +92,7 @@ Sections in a rules file should follow this structure:
    - Only combine closely related sections in the same file
 7. CRITICAL: Be extremely concise and minimal - include ONLY what was explicitly stated in the comment
 8. Keep your updates as minimal as possible. Always favor an addition over a replacement when possible. 
-"""
+""".strip()
 
 RULE_NAMING_CONVENTIONS = """
 Rule files should follow these naming conventions:
@@ -99,7 +107,7 @@ Rule files should follow these naming conventions:
 5. IMPORTANT: Always use the lowest available number in the appropriate range:
    - If creating the first file in a category, use the first number (e.g., 100 for Integration)
    - If adding to an existing category, use the next sequential number (e.g., if 001 exists, use 002)
-"""
+""".strip()
 
 FILE_ORGANIZATION_GUIDELINES = """
 When organizing rules:
@@ -108,7 +116,7 @@ When organizing rules:
 3. Only combine closely related patterns in the same file
 4. If a new rule doesn't clearly belong with existing rules, create a new file
 5. Keep rule files small and focused (typically under 20 lines total)
-"""
+""".strip()
 
 SEQUENTIAL_NUMBERING_GUIDELINES = """
 When numbering rule files:
@@ -119,14 +127,17 @@ When numbering rule files:
    - If files 100 and 102 exist, use 101 (fill gaps when possible)
 4. Analyze existing rule files to determine the next available number
 5. Note that later rules always supersede earlier ones, when in conflict.
-"""
+""".strip()
 
 GLOB_PATTERN_GUIDELINES = """
 When specifying glob patterns:
 1. For language-specific rules, use appropriate file extensions (e.g., *.ts, *.tsx)
 2. For directory-specific rules, use path patterns (e.g., src/components/**/*.tsx)
 3. Avoid overly broad patterns unless the rule truly applies everywhere
-"""
+""".strip()
+
+# Rules context sent to the generation prompt when the repository has no rules yet
+NO_EXISTING_RULES = "No existing Cursor rules found in the repository."
 
 FIRST_RULE_GUIDELINES = """
 When creating the FIRST rule in a repository:
@@ -135,26 +146,32 @@ When creating the FIRST rule in a repository:
 3. Keep the description concise but comprehensive
 4. Use glob patterns that cover the primary codebase files
 5. Structure the content to be clear and actionable
-"""
-
-GOOD_RULE_EXAMPLES = """
-Examples of good rule candidates (short):
-- "Use functional React components with hooks, not classes"
-- "API types go in types/api/responses/"
-- "Use zod for API validation"
-- "Let's stick with camelCase for all variable names"
-- "Hey team, can we please use the logger instead of console.log? Thanks!"
-- "Don't forget to add alt tags to all images"
-
-Examples of good rule candidates (longer):
-- "We've decided to standardize on using the Repository pattern for all data access. Each domain entity should have its own repository class in the repositories/ directory that handles all database operations."
-
-- "For accessibility compliance, all interactive elements need proper ARIA attributes and keyboard navigation support. Buttons should have aria-labels when they don't have text content, and custom components should implement proper keyboard handlers."
-
-- "Hey folks, I noticed we're doing state management in a bunch of different ways. Let's standardize on Redux for global state and React Context for component-specific state that needs to be shared. This will make the codebase way easier to understand!"
-
-- "I'm seeing a lot of different approaches to testing. Going forward, let's use Jest for unit tests and Cypress for E2E. Unit tests should focus on business logic, not implementation details. And please remember to mock external dependencies!"
-"""
+""".strip()
+
+# Example comments that make good rules, kept as data so they can be pruned or reused
+# without editing prompt text
+GOOD_RULE_EXAMPLES_SHORT = (
+    "Use functional React components with hooks, not classes",
+    "API types go in types/api/responses/",
+    "Use zod for API validation",
+    "Let's stick with camelCase for all variable names",
+    "Hey team, can we please use the logger instead of console.log? Thanks!",
+    "Don't forget to add alt tags to all images",
+)
+
+GOOD_RULE_EXAMPLES_LONG = (
+    "We've decided to standardize on using the Repository pattern for all data access. Each domain entity should have its own repository class in the repositories/ directory that handles all database operations.",
+    "For accessibility compliance, all interactive elements need proper ARIA attributes and keyboard navigation support. Buttons should have aria-labels when they don't have text content, and custom components should implement proper keyboard handlers.",
+    "Hey folks, I noticed we're doing state management in a bunch of different ways. Let's standardize on Redux for global state and React Context for component-specific state that needs to be shared. This will make the codebase way easier to understand!",
+    "I'm seeing a lot of different approaches to testing. Going forward, let's use Jest for unit tests and Cypress for E2E. Unit tests should focus on business logic, not implementation details. And please remember to mock external dependencies!",
+)
+
+GOOD_RULE_EXAMPLES = (
+    "Examples of good rule candidates (short):\n"
+    + "\n".join(f'- "{example}"' for example in GOOD_RULE_EXAMPLES_SHORT)
+    + "\n\nExamples of good rule candidates (longer):\n"
+    + "\n\n".join(f'- "{example}"' for example in GOOD_RULE_EXAMPLES_LONG)
+)
 
 CONCISENESS_GUIDELINES = """
 When writing rules, be extremely concise:
@@ -167,10 +184,12 @@ When writing rules, be extremely concise:
 7. When in doubt, leave it out - shorter is better
 8. A good rule is often just a heading and 1-3 bullet points
 9. Maintain a professional tone in the rule regardless of the original comment's tone
-"""
+""".strip()
 
-# First stage prompt: Analyze if a comment deserves a rule
-ANALYSIS_PROMPT = f"""You are an expert at analyzing GitHub PR comments to determine if they warrant creating a Cursor rule.
+# First stage prompt: Analyze if a comment deserves a rule. The prompts are split
+# into a static prefix (instructions and examples, identical on every call, so it
+# can be prompt-cached) and a suffix holding the per-comment variables.
+ANALYSIS_PROMPT_PREFIX = f"""You are an expert at analyzing GitHub PR comments to determine if they warrant creating a Cursor rule.
 
 Cursor rules are project-specific instructions that help control AI behavior in different parts of a codebase. 
 
@@ -180,17 +199,39 @@ Cursor rules are project-specific instructions that help control AI behavior in
 
 {RULE_REJECTION_CRITERIA}
 
-Here is the PR comment to analyze:
-{{comment}}
+"""
+
+ANALYSIS_PROMPT_SUFFIX = """Here is the PR comment to analyze:
+{comment}
 
 Additional context:
-{{context}}
+{context}
 
 Based on the criteria above, could this comment potentially describe a pattern that should be turned into a Cursor rule? 
 Remember: err on the side of rejection - it's better to miss a valid rule than to create unnecessary ones."""
 
+ANALYSIS_PROMPT = ANALYSIS_PROMPT_PREFIX + ANALYSIS_PROMPT_SUFFIX
+
+def split_template_slots(template: str, *names: str) -> Tuple[str, ...]:
+    """Split a template into the static text around its named slots, in order, so
+    rendering is a plain join instead of a format-spec scan over the whole text"""
+    parts = []
+    rest = template
+    for name in names:
+        head, rest = rest.split("{" + name + "}", 1)
+        parts.append(head)
+    parts.append(rest)
+    return tuple(parts)
+
+_ANALYSIS_SUFFIX_PARTS = split_template_slots(ANALYSIS_PROMPT_SUFFIX, "comment", "context")
+
+def render_analysis_suffix(comment: str, context: str) -> str:
+    """Render the per-comment part of the analysis prompt"""
+    before_comment, before_context, after = _ANALYSIS_SUFFIX_PARTS
+    return "".join((before_comment, comment, before_context, context, after))
+
 # Second stage prompt: Generate the rule
-GENERATION_PROMPT = f"""You are an expert at analyzing GitHub PR comments and creating Cursor rules.
+GENERATION_PROMPT_PREFIX = f"""You are an expert at analyzing GitHub PR comments and creating Cursor rules.
 
 Your task has two parts:
 1. First, thoroughly analyze whether this comment should become a Cursor rule
@@ -280,14 +321,26 @@ Key points about changes:
 7. All file paths should be prefixed with .cursor/rules/
 8. Avoid leading \\ns in the content field.
 
-{FIRST_RULE_GUIDELINES if "{{rules}}" == "" else ""}
+"""
 
-Here is the PR comment to analyze:
-{{comment}}
+GENERATION_PROMPT_SUFFIX = """Here is the PR comment to analyze:
+{comment}
 
 Code context:
-{{context}}
+{context}
 
 Existing rules in the codebase:
-{{rules}}
-""" 
\ No newline at end of file
+{rules}
+"""
+
+GENERATION_PROMPT = GENERATION_PROMPT_PREFIX + GENERATION_PROMPT_SUFFIX
+
+_GENERATION_SUFFIX_PARTS = split_template_slots(GENERATION_PROMPT_SUFFIX, "comment", "context", "rules")
+
+def render_generation_suffix(comment: str, context: str, rules: str) -> str:
+    """Render the per-comment part of the generation prompt. The first-rule guidelines
+    only apply when there are no rules yet, so they go here rather than in the
+    prompt-cached prefix."""
+    before_comment, before_context, before_rules, after = _GENERATION_SUFFIX_PARTS
+    first_rule_section = f"\n{FIRST_RULE_GUIDELINES}\n" if not rules or rules == NO_EXISTING_RULES else ""
+    return "".join((before_comment, comment, before_context, context, before_rules, rules, after, first_rule_section))
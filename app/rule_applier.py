@@ -1,13 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 from github import Github, Repository, PullRequest, ContentFile, InputGitTreeElement
-import base64
 import logging
 from .models import SummaryState
 from .prompts import RuleGenerationOutput, RuleChange
-from .cursor_rules import CursorRule, get_current_rules
+from .cursor_rules import CursorRule, MAX_BLOB_FETCH_WORKERS, decode_github_content, get_current_rules
 
 logger = logging.getLogger(__name__)
 
+def split_frontmatter(content: str) -> Tuple[Optional[str], str]:
+    """Split rule file content into (frontmatter, body) with a single pass.
+    frontmatter is None when the content doesn't start with a closed --- block."""
+    if content.startswith('---\n'):
+        parts = content.split('---\n', 2)
+        if len(parts) == 3:
+            return parts[1], parts[2]
+    return None, content
+
+def join_frontmatter(frontmatter: Optional[str], body: str) -> str:
+    """Reassemble rule file content split by split_frontmatter"""
+    return body if frontmatter is None else f"---\n{frontmatter}---\n{body}"
+
+def frontmatter_field(frontmatter: str, key: str) -> Optional[str]:
+    """Get a field's value from frontmatter text without splitting it into lines.
+    The last line starting with "key:" wins, or None if there is none."""
+    prefix = f"\n{key}:"
+    # Searching from the end with a leading newline only matches at line starts
+    start = ("\n" + frontmatter).rfind(prefix)
+    if start == -1:
+        return None
+    start += len(prefix) - 1  # Drop the added newline
+    end = frontmatter.find('\n', start)
+    return frontmatter[start:end if end != -1 else len(frontmatter)].strip()
+
 def merge_rule_changes(
     file_changes: List[RuleGenerationOutput],
     current_content: Optional[str] = None
@@ -21,67 +46,54 @@ def merge_rule_changes(
     Returns:
         The merged content as a string
     """
-    # Check if this is a new file
-    has_new_file_change = any(
-        any(c.is_new_file for c in rule.changes)
-        for rule in file_changes
-    )
-    
-    if has_new_file_change:
-        # Get all new file changes
-        new_file_changes = [
-            change for rule in file_changes
-            for change in rule.changes 
-            if change.is_new_file
-        ]
+    # Collect the new file changes in one pass; any means this is a new file
+    new_file_changes = [
+        change for rule in file_changes
+        for change in rule.changes 
+        if change.is_new_file
+    ]
+    
+    if new_file_changes:
+        # Use the most recent change for metadata
+        latest_change = new_file_changes[-1]
         
-        if new_file_changes:
-            # Use the most recent change for metadata
-            latest_change = new_file_changes[-1]
-            
-            # Start with the YAML frontmatter
-            final_content = "---\n"
-            final_content += f"description: {latest_change.file_description}\n"
-            
-            # Format globs as comma-separated quoted strings
-            globs = latest_change.file_globs if isinstance(latest_change.file_globs, list) else [latest_change.file_globs]
-            globs_str = ", ".join(f'{g}' for g in globs)
-            final_content += f"globs: {globs_str}\n"
-            final_content += "---\n\n"
-            
-            # Concatenate content from all changes
-            for i, change in enumerate(new_file_changes):
-                if i > 0:  # Add newline between changes
-                    final_content += "\n"
-                final_content += change.content
-            
-            # Ensure content ends with newline
-            if not final_content.endswith('\n'):
-                final_content += '\n'
-                
-            return final_content
+        # Format globs as comma-separated quoted strings
+        globs = latest_change.file_globs if isinstance(latest_change.file_globs, list) else [latest_change.file_globs]
+        globs_str = ", ".join(f'{g}' for g in globs)
+        
+        # Start with the YAML frontmatter, then the content from all changes
+        # (newline separated), joined once at the end
+        final_content = "".join((
+            "---\n",
+            f"description: {latest_change.file_description}\n",
+            f"globs: {globs_str}\n",
+            "---\n\n",
+            "\n".join(change.content for change in new_file_changes),
+        ))
+        
+        # Ensure content ends with newline
+        if not final_content.endswith('\n'):
+            final_content += '\n'
+        
+        return final_content
     
-    # Start with current content or empty string
-    final_content = current_content if current_content is not None else ""
+    # Split the frontmatter off once. Changes are applied to the body, falling back to
+    # the whole file only for text that isn't in the body (e.g. a frontmatter line, or
+    # a context spanning the closing ---)
+    frontmatter, body = split_frontmatter(current_content if current_content is not None else "")
     
     # Extract current metadata if it exists
     current_description = None
     current_globs = None
-    if final_content.startswith('---\n'):
-        try:
-            parts = final_content.split('---\n', 2)
-            metadata = parts[1]
-            for line in metadata.split('\n'):
-                if line.startswith('description:'):
-                    current_description = line[len('description:'):].strip()
-                elif line.startswith('globs:'):
-                    current_globs = line[len('globs:'):].strip()
-        except:
-            logger.warning("Failed to parse current metadata, will use defaults")
+    if frontmatter is not None:
+        current_description = frontmatter_field(frontmatter, 'description')
+        current_globs = frontmatter_field(frontmatter, 'globs')
     
     # Track if we need to update metadata
     new_description = current_description
     new_globs = current_globs
+    # Only the globs that end up winning get formatted, after the loop
+    winning_globs = None
     
     # Apply changes in reverse order so most recent takes precedence
     for rule in reversed(file_changes):
@@ -90,54 +102,60 @@ def merge_rule_changes(
             if change.file_description:
                 new_description = change.file_description
             if change.file_globs:
-                globs = change.file_globs if isinstance(change.file_globs, list) else [change.file_globs]
-                new_globs = ", ".join(f'"{g}"' for g in globs)
+                winning_globs = change.file_globs
             
             # Handle content changes
             if change.type == "replacement" and change.text_to_replace:
                 # For replacements, replace the exact text
-                final_content = final_content.replace(change.text_to_replace, change.content)
+                if change.text_to_replace in body or frontmatter is None:
+                    body = body.replace(change.text_to_replace, change.content)
+                else:
+                    frontmatter, body = split_frontmatter(
+                        join_frontmatter(frontmatter, body).replace(change.text_to_replace, change.content)
+                    )
             elif change.existing_content_context:
                 # For context-based changes, find the context and add content
-                context_pos = final_content.find(change.existing_content_context)
+                context_pos = body.find(change.existing_content_context)
+                whole = None
+                if context_pos == -1 and frontmatter is not None:
+                    whole = join_frontmatter(frontmatter, body)
+                    context_pos = whole.find(change.existing_content_context)
                 if context_pos != -1:
-                    # Add after the context
+                    # Add after the context, building the new text in one allocation
                     context_end = context_pos + len(change.existing_content_context)
-                    final_content = (
-                        final_content[:context_end] + 
-                        "\n" + 
-                        change.content + 
-                        final_content[context_end:]
-                    )
+                    if whole is None:
+                        body = "".join((body[:context_end], "\n", change.content, body[context_end:]))
+                    else:
+                        frontmatter, body = split_frontmatter(
+                            "".join((whole[:context_end], "\n", change.content, whole[context_end:]))
+                        )
                 else:
                     # If context not found, append to end
-                    if final_content and not final_content.endswith('\n'):
-                        final_content += '\n'
-                    final_content += change.content
+                    if body and not body.endswith('\n'):
+                        body += '\n'
+                    body += change.content
             elif change.content:  # Only append if there's actual content
                 # No context, just append
-                if final_content and not final_content.endswith('\n'):
-                    final_content += '\n'
-                final_content += change.content
+                if body and not body.endswith('\n'):
+                    body += '\n'
+                body += change.content
+    
+    if winning_globs:
+        globs = winning_globs if isinstance(winning_globs, list) else [winning_globs]
+        new_globs = ", ".join(f'"{g}"' for g in globs)
     
     # If we have metadata changes, reconstruct the file with new metadata
     if (new_description != current_description or new_globs != current_globs) and (new_description or new_globs):
-        # Extract the body content (everything after the second ---)
-        body_content = final_content
-        if final_content.startswith('---\n'):
-            try:
-                body_content = final_content.split('---\n', 2)[2]
-            except:
-                pass
-        
-        # Reconstruct with new metadata
-        final_content = "---\n"
+        parts = ["---\n"]
         if new_description:
-            final_content += f"description: {new_description}\n"
+            parts.append(f"description: {new_description}\n")
         if new_globs:
-            final_content += f"globs: {new_globs}\n"
-        final_content += "---\n\n"
-        final_content += body_content
+            parts.append(f"globs: {new_globs}\n")
+        parts.append("---\n\n")
+        parts.append(body)
+        final_content = "".join(parts)
+    else:
+        final_content = join_frontmatter(frontmatter, body)
     
     return final_content
 
@@ -148,7 +166,11 @@ def get_file_content(repo: Repository, path: str, ref: str) -> Tuple[Optional[st
         if isinstance(file_info, list):
             logger.warning(f"File path {path} returned multiple contents, using first one")
             file_info = file_info[0]
-        content = base64.b64decode(file_info.content).decode('utf-8')
+        raw = file_info.content
+        if not raw and file_info.size:
+            # The contents API leaves content empty for files over 1MB; the blob has it
+            raw = repo.get_git_blob(file_info.sha).content
+        content = decode_github_content(raw)
         return content, file_info.sha
     except:
         return None, None
@@ -165,16 +187,28 @@ def create_commit_for_changes(
         branch: The branch to commit to
         file_changes: Dict mapping file paths to (content, sha) tuples
                      If sha is None, it's a new file
+    
+    Returns a dict with the commit SHA and whether a commit was made. With no file
+    changes, "changed" is False and "sha" is the branch's current head
     """
     try:
+        if not file_changes:
+            # Nothing changed, so don't create an empty commit
+            logger.info("No file changes to commit")
+            return {"sha": repo.get_branch(branch).commit.sha, "changed": False}
+        
         # Create the tree with all file changes
         base_tree = repo.get_git_tree(sha=branch)
         tree_elements = []
         
-        for file_path, (content, _) in file_changes.items():
-            # Create a blob for the file content
-            blob = repo.create_git_blob(content=content, encoding='utf-8')
-            
+        # Create a blob for each file's content, concurrently so the uploads overlap
+        with ThreadPoolExecutor(max_workers=min(MAX_BLOB_FETCH_WORKERS, len(file_changes))) as executor:
+            blobs = list(executor.map(
+                lambda content: repo.create_git_blob(content=content, encoding='utf-8'),
+                [content for content, _ in file_changes.values()]
+            ))
+        
+        for file_path, blob in zip(file_changes, blobs):
             # Add the file to the tree using InputGitTreeElement
             element = InputGitTreeElement(
                 path=file_path,
@@ -202,22 +236,25 @@ def create_commit_for_changes(
         ref = repo.get_git_ref(f"heads/{branch}")
         ref.edit(sha=commit.sha)
         
-        return {"sha": commit.sha}
+        return {"sha": commit.sha, "changed": True}
         
     except Exception as e:
         logger.error(f"Failed to create commit: {str(e)}")
         raise
 
-def apply_rule_changes(pr: PullRequest, state: SummaryState) -> Dict[str, str]:
+def apply_rule_changes(pr: PullRequest, state: SummaryState) -> Dict:
     """Apply all rule changes to the PR's branch in a single commit
     
-    Returns a dict with the commit SHA
+    Returns a dict with the commit SHA, and "changed" False when the changes left
+    every file as it was and nothing was committed
     """
     repo = pr.base.repo
     branch = pr.head.ref
     
-    # Get current rules for context
+    # One listing of the rules directory reads every rule file on the branch, so
+    # files in it don't need their own contents request
     current_rules = get_current_rules(repo, ref=branch)
+    rules_by_path = {rule.file_path: rule for rule in current_rules}
     
     # Group changes by file
     changes_by_file = {}
@@ -227,17 +264,36 @@ def apply_rule_changes(pr: PullRequest, state: SummaryState) -> Dict[str, str]:
             changes_by_file[file_path] = []
         changes_by_file[file_path].append(rule_output)
     
+    # Get current content and SHA of every touched file. Anything the listing didn't
+    # cover (a new file, or one outside the rules directory) is fetched concurrently,
+    # so N files cost one round-trip of latency rather than N
+    file_contents = {
+        path: (rules_by_path[path].content, rules_by_path[path].sha)
+        for path in changes_by_file if path in rules_by_path
+    }
+    missing_paths = [path for path in changes_by_file if path not in file_contents]
+    if missing_paths:
+        with ThreadPoolExecutor(max_workers=min(MAX_BLOB_FETCH_WORKERS, len(missing_paths))) as executor:
+            file_contents.update(zip(
+                missing_paths,
+                executor.map(lambda path: get_file_content(repo, path, branch), missing_paths)
+            ))
+    
     # Process each file's changes
     final_changes = {}  # Maps file paths to (content, sha) tuples
     
     for file_path, file_changes in changes_by_file.items():
         try:
-            # Get current file content and SHA if it exists
-            current_content, current_sha = get_file_content(repo, file_path, branch)
+            current_content, current_sha = file_contents[file_path]
             
             # Merge all changes for this file
             final_content = merge_rule_changes(file_changes, current_content)
             
+            # Nothing to commit if the merge didn't change the file (e.g. text to replace not found)
+            if current_content is not None and final_content == current_content:
+                logger.info(f"Changes leave {file_path} unchanged, skipping it")
+                continue
+            
             # Store the final content and SHA
             final_changes[file_path] = (final_content, current_sha if current_content is not None else None)
                 
@@ -1,40 +1,36 @@
 from typing import List, Dict, Optional, Literal, Protocol, runtime_checkable
-from pydantic import BaseModel
-import json
+from pydantic import BaseModel, PrivateAttr
+import orjson
 import os
 import logging
+import atexit
+import itertools
+import importlib.util
+import threading
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 import base64
 
-# Optional storage backend imports - imported on demand
+# Optional storage backends. The SDKs are slow to import (boto3 alone loads dozens of
+# modules), so only check they're installed here; each backend imports its SDK on use.
+def _module_available(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ImportError:  # A parent package is missing
+        return False
+
 storage_backends = {
-    'gcs': False,
-    's3': False,
-    'azure': False
+    'gcs': _module_available('google.cloud.storage'),
+    's3': _module_available('boto3'),
+    'azure': _module_available('azure.storage.blob')
 }
 
-try:
-    from google.cloud import storage
-    storage_backends['gcs'] = True
-except ImportError:
-    pass
-
-try:
-    import boto3
-    storage_backends['s3'] = True
-except ImportError:
-    pass
-
-try:
-    from azure.storage.blob import BlobServiceClient
-    storage_backends['azure'] = True
-except ImportError:
-    pass
-
 logger = logging.getLogger(__name__)
 
+# Saves requested within this many seconds of each other are written once
+SAVE_DEBOUNCE_SECONDS = 1.0
+
 class RecentSuggestion(BaseModel):
     """A recent suggestion made by the bot"""
     id: str  # Unique ID for the suggestion
@@ -68,6 +64,34 @@ class ServerState(BaseModel):
     repositories: Dict[str, ConnectedRepository] = {}  # Keyed by full_name
     recent_suggestions: List[RecentSuggestion] = []
     max_suggestions_history: int = 250  # Maximum number of suggestions to keep
+    summary_comment_ids: Dict[str, int] = {}  # Summary comment ID keyed by "owner/repo#number"
+    max_summary_comment_ids: int = 1000  # Maximum number of PRs to remember, least recently set dropped first
+    # Serialized repository list for the dashboard, rebuilt after any repository change
+    _repositories_json: Optional[bytes] = PrivateAttr(default=None)
+    # Indexes over recent_suggestions, kept in step by add_suggestion
+    _suggestions_by_id: Dict[str, RecentSuggestion] = PrivateAttr(default_factory=dict)
+    _suggestions_by_repo: Dict[str, List[RecentSuggestion]] = PrivateAttr(default_factory=dict)
+    
+    def model_post_init(self, __context) -> None:
+        """Build the suggestion indexes for a loaded state"""
+        for suggestion in self.recent_suggestions:
+            self._index_suggestion(suggestion)
+        self._trim_summary_comment_ids()
+    
+    def _index_suggestion(self, suggestion: RecentSuggestion) -> None:
+        # The oldest suggestion wins an ID clash, as with a front-to-back scan
+        self._suggestions_by_id.setdefault(suggestion.id, suggestion)
+        self._suggestions_by_repo.setdefault(suggestion.repository, []).append(suggestion)
+    
+    def _unindex_suggestion(self, suggestion: RecentSuggestion) -> None:
+        if self._suggestions_by_id.get(suggestion.id) is suggestion:
+            del self._suggestions_by_id[suggestion.id]
+        # Trimmed suggestions are the oldest, so they're at the front of their repo's list
+        repo_suggestions = self._suggestions_by_repo.get(suggestion.repository)
+        if repo_suggestions and repo_suggestions[0] is suggestion:
+            del repo_suggestions[0]
+            if not repo_suggestions:
+                del self._suggestions_by_repo[suggestion.repository]
     
     def add_suggestion(self, suggestion: RecentSuggestion) -> None:
         """Add a new suggestion to the history"""
@@ -76,27 +100,56 @@ class ServerState(BaseModel):
             suggestion.status = "dry_run"
         
         self.recent_suggestions.append(suggestion)
+        self._index_suggestion(suggestion)
         # Trim history if needed
         if len(self.recent_suggestions) > self.max_suggestions_history:
+            for dropped in self.recent_suggestions[:-self.max_suggestions_history]:
+                self._unindex_suggestion(dropped)
             self.recent_suggestions = self.recent_suggestions[-self.max_suggestions_history:]
             
+    def get_suggestion(self, suggestion_id: str) -> Optional[RecentSuggestion]:
+        """Get a recent suggestion by ID"""
+        return self._suggestions_by_id.get(suggestion_id)
+            
     def update_suggestion_status(self, suggestion_id: str, status: str) -> None:
         """Update the status of a suggestion"""
-        for suggestion in self.recent_suggestions:
-            if suggestion.id == suggestion_id:
-                # Don't update status of dry run suggestions
-                if not suggestion.is_dry_run:
-                    suggestion.status = status
-                break
+        suggestion = self._suggestions_by_id.get(suggestion_id)
+        # Don't update status of dry run suggestions
+        if suggestion is not None and not suggestion.is_dry_run:
+            suggestion.status = status
                 
+    def get_summary_comment_id(self, pr_key: str) -> Optional[int]:
+        """Get the ID of a PR's summary comment, if we've seen one"""
+        return self.summary_comment_ids.get(pr_key)
+        
+    def set_summary_comment_id(self, pr_key: str, comment_id: int) -> bool:
+        """Remember a PR's summary comment ID. Returns True if it changed.
+        Only the most recently set max_summary_comment_ids PRs are kept."""
+        if self.summary_comment_ids.get(pr_key) == comment_id:
+            return False
+        # Re-inserting moves the PR to the end, so the dict stays in least recently set order
+        self.summary_comment_ids.pop(pr_key, None)
+        self.summary_comment_ids[pr_key] = comment_id
+        self._trim_summary_comment_ids()
+        return True
+    
+    def _trim_summary_comment_ids(self) -> None:
+        # A forgotten PR just gets its summary comment found by scanning its comments again
+        excess = len(self.summary_comment_ids) - self.max_summary_comment_ids
+        if excess > 0:
+            for pr_key in list(itertools.islice(self.summary_comment_ids, excess)):
+                del self.summary_comment_ids[pr_key]
+        
     def add_repository(self, repo: ConnectedRepository) -> None:
         """Add or update a connected repository"""
         self.repositories[repo.full_name] = repo
+        self._repositories_json = None
         
     def update_repository_activity(self, full_name: str) -> None:
         """Update the last_active timestamp for a repository"""
         if full_name in self.repositories:
             self.repositories[full_name].last_active = datetime.utcnow()
+            self._repositories_json = None
             
     def get_repository(self, full_name: str) -> Optional[ConnectedRepository]:
         """Get repository info by full name"""
@@ -104,15 +157,24 @@ class ServerState(BaseModel):
         
     def get_recent_suggestions_for_repo(self, full_name: str) -> List[RecentSuggestion]:
         """Get recent suggestions for a specific repository"""
-        return [s for s in self.recent_suggestions if s.repository == full_name]
+        return list(self._suggestions_by_repo.get(full_name, ()))
         
     def set_repository_enabled(self, full_name: str, enabled: bool) -> bool:
         """Enable or disable a repository. Returns True if successful."""
         if full_name in self.repositories:
             self.repositories[full_name].enabled = enabled
+            self._repositories_json = None
             return True
         return False
 
+    def get_repositories_json(self) -> bytes:
+        """The {"repositories": [...]} API response body, serialized once per change"""
+        if self._repositories_json is None:
+            self._repositories_json = orjson.dumps({
+                "repositories": [repo.model_dump(mode="json") for repo in self.repositories.values()]
+            })
+        return self._repositories_json
+
     def is_repository_enabled(self, full_name: str) -> bool:
         """Check if a repository is enabled"""
         repo = self.repositories.get(full_name)
@@ -150,11 +212,39 @@ class LocalFileStorage(StorageBackend):
         except Exception as e:
             logger.error(f"Failed to write to local file: {e}")
 
+# SDK clients shared by every backend instance in the process, so a new StateManager
+# reuses their connection pools and loaded credentials instead of building its own
+_gcs_client = None
+_s3_client = None
+_azure_service_clients: Dict[str, object] = {}
+
+def _get_gcs_client():
+    global _gcs_client
+    if _gcs_client is None:
+        from google.cloud import storage
+        _gcs_client = storage.Client()
+    return _gcs_client
+
+def _get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client('s3')
+    return _s3_client
+
+def _get_azure_service_client(connection_string: str):
+    client = _azure_service_clients.get(connection_string)
+    if client is None:
+        from azure.storage.blob import BlobServiceClient
+        client = BlobServiceClient.from_connection_string(connection_string)
+        _azure_service_clients[connection_string] = client
+    return client
+
 class GoogleCloudStorage(StorageBackend):
     """Google Cloud Storage implementation"""
     def __init__(self, bucket: str, path: str):
         try:
-            self.client = storage.Client()
+            self.client = _get_gcs_client()
             self.bucket = self.client.bucket(bucket)
             self.blob = self.bucket.blob(path.lstrip('/'))
         except ImportError:
@@ -179,7 +269,7 @@ class S3Storage(StorageBackend):
     """AWS S3 Storage implementation"""
     def __init__(self, bucket: str, path: str):
         try:
-            self.s3 = boto3.client('s3')
+            self.s3 = _get_s3_client()
             self.bucket = bucket
             self.key = path.lstrip('/')
         except ImportError:
@@ -208,7 +298,7 @@ class AzureStorage(StorageBackend):
             connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
             if not connection_string:
                 raise ValueError("AZURE_STORAGE_CONNECTION_STRING environment variable is required")
-            self.service_client = BlobServiceClient.from_connection_string(connection_string)
+            self.service_client = _get_azure_service_client(connection_string)
             self.container_client = self.service_client.get_container_client(container)
             self.blob_client = self.container_client.get_blob_client(path.lstrip('/'))
         except ImportError:
@@ -254,24 +344,52 @@ class StateManager:
         
         self.storage = get_storage_backend(storage_url)
         self.state = self._load_state()
+        self._mode_dict: Optional[dict] = None
+        self._flush_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._dirty = False
+        # Write anything still pending when the process exits
+        atexit.register(self.flush)
         
     def _load_state(self) -> ServerState:
         """Load state from storage or create new if doesn't exist"""
         try:
             data = self.storage.read()
             if data:
-                return ServerState.model_validate(json.loads(data))
+                # Parsed and validated in one pass, without an intermediate dict
+                return ServerState.model_validate_json(data)
         except Exception as e:
             logger.error(f"Failed to load state: {e}")
         return ServerState()
         
     def save_state(self) -> None:
-        """Save current state to storage"""
-        try:
-            data = json.dumps(self.state.model_dump(), indent=2, default=str)
-            self.storage.write(data)
-        except Exception as e:
-            logger.error(f"Failed to save state: {e}")
+        """Schedule the current state to be saved to storage. Bursts of changes (like
+        marking every suggestion applied) are coalesced into a single write."""
+        with self._flush_lock:
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(SAVE_DEBOUNCE_SECONDS, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+                
+    def flush(self) -> None:
+        """Write the state to storage now if there are unsaved changes"""
+        # Writes are serialized, but save_state only waits on the short flush lock
+        with self._write_lock:
+            with self._flush_lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+            try:
+                # Serialized straight to JSON, without building the state as a dict first
+                data = self.state.model_dump_json(indent=2)
+                self.storage.write(data)
+            except Exception as e:
+                logger.error(f"Failed to save state: {e}")
             
     def get_state(self) -> ServerState:
         """Get the current server state"""
@@ -279,12 +397,22 @@ class StateManager:
         
     def set_mode(self, is_disabled: bool = None, dry_run: bool = None) -> None:
         """Update server operation mode"""
+        mode = self.state.mode
+        if (is_disabled is None or is_disabled == mode.is_disabled) and (dry_run is None or dry_run == mode.dry_run):
+            return  # Nothing changed, skip the write
         if is_disabled is not None:
-            self.state.mode.is_disabled = is_disabled
+            mode.is_disabled = is_disabled
         if dry_run is not None:
-            self.state.mode.dry_run = dry_run
+            mode.dry_run = dry_run
+        self._mode_dict = None
         self.save_state()
         
+    def get_mode_dict(self) -> dict:
+        """The current mode as a dict, only re-dumped after set_mode. Treat as read-only."""
+        if self._mode_dict is None:
+            self._mode_dict = self.state.mode.model_dump()
+        return self._mode_dict
+        
 # Global state manager instance
 _state_manager: Optional[StateManager] = None
 
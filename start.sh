@@ -1,4 +1,6 @@
 #!/bin/bash
 
 # Start the backend (which will serve the static frontend)
-cd /app && uvicorn app.main:app --host 0.0.0.0 --port 8000 
\ No newline at end of file
+# uvloop and httptools come with uvicorn[standard]. Stays on one worker: server
+# state, caches and duplicate-suggestion checks all live in process memory
+cd /app && uvicorn app.main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools 
\ No newline at end of file
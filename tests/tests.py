@@ -2,8 +2,9 @@ import os
 import sys
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
+from functools import lru_cache
 from dotenv import load_dotenv
-import json
+import orjson
 from unittest.mock import MagicMock, patch
 import base64
 
@@ -19,85 +20,82 @@ import yaml
 from app.prompts import (
     RuleAnalysisOutput,
     RuleGenerationOutput,
-    RuleChange,
-    ANALYSIS_PROMPT,
-    GENERATION_PROMPT
+    RuleChange
 )
-from app.llm import should_create_rule, generate_rule, get_llm, base_llm
-from langchain.prompts import PromptTemplate
-from app.cursor_rules import CursorRule
+from app import llm
+from app.llm import should_create_rule, generate_rule, get_llm, invoke_cached, _in_flight
+from cachetools import TTLCache
+import asyncio
+from app.cursor_rules import CursorRule, get_current_rules
+from app.constants import SUGGESTION_SIGNATURE
 from app.models import SummaryState
 from app.formatters import format_summary_comment
 from app.rule_applier import apply_rule_changes
+from app.handlers import handle_apply_command, get_with_etag, get_cached_comments, get_comments_graphql, get_handled_thread_roots, invalidate_comment_cache
+from github import GithubException, RateLimitExceededException, UnknownObjectException
 
-# Create prompt templates
-analysis_template = PromptTemplate(
-    template=ANALYSIS_PROMPT,
-    input_variables=["comment", "context"]
-)
+# libyaml's C loader when PyYAML was built with it, same results as safe_load
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-generation_template = PromptTemplate(
-    template=GENERATION_PROMPT,
-    input_variables=["comment", "context", "rules"]
-)
+def dump_json(obj) -> str:
+    """Pretty-print an object as JSON for test output"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
 
-# Initialize LLM if not already initialized
-if not base_llm:
-    base_llm = get_llm()
-    
-    # Create analysis chain
-    analysis_llm = base_llm.with_structured_output(RuleAnalysisOutput)
-    analysis_chain = analysis_template | analysis_llm
-    
-    # Create generation chain
-    generation_llm = base_llm.with_structured_output(RuleGenerationOutput)
-    generation_chain = generation_template | generation_llm
+@lru_cache(maxsize=None)
+def _get_chains():
+    """Return the app's LLM chains, checked on first use so tests that never call
+    the LLM don't need credentials or pay for initialization at import"""
+    if llm.analysis_chain is None or llm.generation_chain is None:
+        # Raises with the missing-key message when the app couldn't set up its LLM
+        get_llm()
+    return llm.analysis_chain, llm.generation_chain
 
-def load_single_test_cases():
-    """Load all individual test cases from the test_cases directory"""
+def get_single_test_case_files() -> List[Path]:
+    """List the individual test case files, without reading them"""
     test_cases_dir = Path(__file__).parent / "test_cases"
-    test_cases = []
-    
-    for i, case_file in enumerate(sorted(test_cases_dir.glob("*.yaml"))):
-        with open(case_file) as f:
-            data = yaml.safe_load(f)
-            print(f"Loading test case {i}: {case_file} -> {data['name']}")
-            test_cases.append(data)
-    
-    return test_cases
+    return sorted(test_cases_dir.glob("*.yaml"))
 
-def load_merge_test_cases():
-    """Load merge test cases from the merge_test_cases directory.
-    Each subdirectory represents one merge test scenario."""
-    test_cases_dir = Path(__file__).parent / "merge_test_cases"
-    if not test_cases_dir.exists():
-        return []
+# Listed once at import, shared by the tests parametrized over them
+SINGLE_CASE_FILES = get_single_test_case_files()
+
+@lru_cache(maxsize=None)
+def load_single_test_case(case_file: Path) -> dict:
+    """Load one individual test case. Tests are parametrized over the files and load
+    their case when they run, so `-k` selecting a few cases only reads those.
+    Cached, since several tests are parametrized over the same cases."""
+    # One bulk read per file; the loader parses the bytes directly
+    data = yaml.load(case_file.read_bytes(), Loader=YAML_LOADER)
+    print(f"Loading test case: {case_file} -> {data['name']}")
+    return data
+
+@lru_cache(maxsize=None)
+def get_suggestion_files(scenario_dir: Path) -> Tuple[Path, ...]:
+    """List a merge scenario's numbered suggestion files in numeric order, so
+    10_x.yaml comes after 2_x.yaml"""
+    return tuple(sorted(
+        scenario_dir.glob("[0-9]*.yaml"),
+        key=lambda p: (int(p.stem.split('_', 1)[0]), p.name)
+    ))
+
+@lru_cache(maxsize=None)
+def _load_scenario(scenario_dir: Path) -> dict:
+    """Load one merge scenario directory: its metadata and numbered suggestions.
+    Cached, so each directory is parsed once per session."""
+    # Load scenario metadata
+    metadata = yaml.load((scenario_dir / "metadata.yaml").read_bytes(), Loader=YAML_LOADER)
         
-    test_cases = []
-    
-    for scenario_dir in sorted(test_cases_dir.iterdir()):
-        if not scenario_dir.is_dir():
-            continue
-            
-        # Load scenario metadata
-        with open(scenario_dir / "metadata.yaml") as f:
-            metadata = yaml.safe_load(f)
+    # Load each suggestion in order
+    suggestions = [
+        yaml.load(case_file.read_bytes(), Loader=YAML_LOADER)
+        for case_file in get_suggestion_files(scenario_dir)
+    ]
             
-        # Load each suggestion in order
-        suggestions = []
-        for i, case_file in enumerate(sorted(scenario_dir.glob("[0-9]*.yaml")), 1):
-            with open(case_file) as f:
-                data = yaml.safe_load(f)
-                suggestions.append(data)
-                
-        test_cases.append({
-            "name": metadata["name"],
-            "description": metadata.get("description", ""),
-            "existing_rules": metadata.get("existing_rules", {}),
-            "suggestions": suggestions
-        })
-        
-    return test_cases
+    return {
+        "name": metadata["name"],
+        "description": metadata.get("description", ""),
+        "existing_rules": metadata.get("existing_rules", {}),
+        "suggestions": suggestions
+    }
 
 def print_separator(title: str):
     """Print a separator with a title"""
@@ -105,28 +103,41 @@ def print_separator(title: str):
     print(f" {title} ".center(80, "="))
     print("=" * 80 + "\n")
 
-def convert_to_cursor_rules(rules_dict: dict) -> List[CursorRule]:
-    """Convert a dictionary of rules to CursorRule objects"""
+@lru_cache(maxsize=None)
+def parse_frontmatter(frontmatter: str) -> Tuple[Tuple[str, object], ...]:
+    """Parse a rule's YAML frontmatter into (key, value) pairs, lists as tuples.
+    Cached per frontmatter, since the same existing rules show up across many
+    parametrized cases; a YAMLError is raised again on every call."""
+    data = yaml.load(frontmatter, Loader=YAML_LOADER) or {}
+    return tuple((key, tuple(val) if isinstance(val, list) else val) for key, val in data.items())
+
+@lru_cache(maxsize=None)
+def _cursor_rules_from_items(rule_items: Tuple[Tuple[str, str], ...]) -> Tuple[Tuple[CursorRule, ...], Tuple[str, ...]]:
+    """Build the CursorRule objects for a set of rule files, with any parse warnings.
+    Cached, since the same existing rules are converted by several tests."""
     current_rules = []
-    for filename, content in rules_dict.items():
+    warnings = []
+    for filename, content in rule_items:
         # Split on first --- to get frontmatter
         parts = content.split('---', 2)
         if len(parts) >= 3:
             # Parse frontmatter
             try:
-                frontmatter = yaml.safe_load(parts[1])
+                frontmatter = dict(parse_frontmatter(parts[1]))
                 description = frontmatter.get('description', '')
                 globs = frontmatter.get('globs', '*')
                 # Handle both string and list formats for globs
                 if isinstance(globs, str):
                     # Split on commas and clean up whitespace
                     globs = [g.strip() for g in globs.split(',')]
+                else:
+                    globs = list(globs)
             except yaml.YAMLError:
-                print(f"Warning: Failed to parse frontmatter in {filename}, using defaults")
+                warnings.append(f"Warning: Failed to parse frontmatter in {filename}, using defaults")
                 globs = ['*']
                 description = ''
         else:
-            print(f"Warning: No frontmatter found in {filename}, using defaults")
+            warnings.append(f"Warning: No frontmatter found in {filename}, using defaults")
             globs = ['*']
             description = ''
             
@@ -137,10 +148,33 @@ def convert_to_cursor_rules(rules_dict: dict) -> List[CursorRule]:
             content=content,
             file_path=filename
         ))
-    return current_rules
+    return tuple(current_rules), tuple(warnings)
+
+def convert_to_cursor_rules(rules_dict: dict) -> List[CursorRule]:
+    """Convert a dictionary of rules to CursorRule objects"""
+    current_rules, warnings = _cursor_rules_from_items(tuple(sorted(rules_dict.items())))
+    for warning in warnings:
+        print(warning)
+    # Keep the file order of the dict, the cache key is sorted
+    by_path = {rule.file_path: rule for rule in current_rules}
+    return [by_path[filename] for filename in rules_dict]
+
+def format_rules_context(rules_dict: dict) -> str:
+    """Format existing rules for the generation prompt"""
+    return "".join(
+        f"File: {filename}\n```\n{content}\n```\n\n"
+        for filename, content in rules_dict.items()
+    )
 
 def convert_to_rule_generation_output(expected_gen: dict) -> RuleGenerationOutput:
     """Convert expected generation dict to RuleGenerationOutput"""
+    # RuleGenerationOutput is frozen, so one instance per distinct dict can be shared
+    return _rule_generation_output_from_json(orjson.dumps(expected_gen, option=orjson.OPT_SORT_KEYS))
+
+@lru_cache(maxsize=None)
+def _rule_generation_output_from_json(expected_gen_json: bytes) -> RuleGenerationOutput:
+    """Build a RuleGenerationOutput from the canonical JSON of an expected generation"""
+    expected_gen = orjson.loads(expected_gen_json)
     return RuleGenerationOutput(
         should_generate=expected_gen["should_generate"],
         reason=expected_gen["reason"],
@@ -161,9 +195,11 @@ def convert_to_rule_generation_output(expected_gen: dict) -> RuleGenerationOutpu
     )
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize("test_case", load_single_test_cases())
-async def test_prompts(test_case):
+@pytest.mark.parametrize("case_file", SINGLE_CASE_FILES, ids=lambda p: p.stem)
+async def test_prompts(case_file: Path):
     """Test both prompts against a test case"""
+    _get_chains()
+    test_case = load_single_test_case(case_file)
     print_separator(f"Testing case: {test_case['name']}")
     
     print("Input PR Comment:")
@@ -183,22 +219,17 @@ async def test_prompts(test_case):
     if "expected_analysis" in test_case:
         print_separator("Analysis Stage")
         print("Expected Analysis:")
-        print(json.dumps(test_case["expected_analysis"], indent=2))
-        
-        # Format existing rules for the prompt
-        rules_context = ""
-        for filename, content in test_case.get("existing_rules", {}).items():
-            rules_context += f"File: {filename}\n```\n{content}\n```\n\n"
+        print(dump_json(test_case["expected_analysis"]))
         
         result = await should_create_rule(
             test_case["pr_comment"],
             test_case.get("code_context")
         )
         print("\nActual Analysis:")
-        print(json.dumps({
+        print(dump_json({
             "should_create_rule": result.should_create_rule,
             "reason": result.reason
-        }, indent=2))
+        }))
         
         # Check analysis result
         analysis_passed = result.should_create_rule == test_case["expected_analysis"]["should_create_rule"]
@@ -208,20 +239,15 @@ async def test_prompts(test_case):
     if "expected_generation" in test_case:
         print_separator("Generation Stage")
         print("Expected Generation:")
-        print(json.dumps(test_case["expected_generation"], indent=2))
-        
-        # Format existing rules for the prompt
-        rules_context = ""
-        for filename, content in test_case.get("existing_rules", {}).items():
-            rules_context += f"File: {filename}\n```\n{content}\n```\n\n"
+        print(dump_json(test_case["expected_generation"]))
         
         result = await generate_rule(
             test_case["pr_comment"],
             test_case.get("code_context"),
-            rules_context
+            format_rules_context(test_case.get("existing_rules", {}))
         )
         print("\nActual Generation:")
-        print(json.dumps({
+        print(dump_json({
             "should_generate": result.should_generate,
             "reason": result.reason,
             "operation": result.operation,
@@ -238,7 +264,7 @@ async def test_prompts(test_case):
                 }
                 for c in result.changes
             ] if result.should_generate else []
-        }, indent=2))
+        }))
         
         # Check generation results
         generation_passed = result.should_generate == test_case["expected_generation"]["should_generate"]
@@ -285,9 +311,10 @@ async def test_prompts(test_case):
     # Final assertion combining both stages
     assert test_passed, "Test failed - see above output for details"
 
-@pytest.mark.parametrize("test_case", load_single_test_cases())
-def test_format_suggestion_comment(test_case):
+@pytest.mark.parametrize("case_file", SINGLE_CASE_FILES, ids=lambda p: p.stem)
+def test_format_suggestion_comment(case_file: Path):
     """Test the format_suggestion_comment function using expected generation output from test cases"""
+    test_case = load_single_test_case(case_file)
     if "expected_generation" not in test_case or not test_case["expected_generation"]["should_generate"]:
         pytest.skip("Test case doesn't have expected generation output or shouldn't generate")
     
@@ -309,15 +336,63 @@ def test_format_suggestion_comment(test_case):
     # No assertions since we just want to see the output
     assert True
 
-@pytest.mark.parametrize("test_case", load_merge_test_cases())
-def test_merge_suggestions(test_case):
+def load_specific_merge_test_case(case_name: str):
+    """Load a specific merge test case by directory name"""
+    test_cases_dir = Path(__file__).parent / "merge_test_cases"
+    if not test_cases_dir.exists():
+        return None
+        
+    case_dir = test_cases_dir / case_name
+    if not case_dir.exists() or not case_dir.is_dir():
+        return None
+        
+    return _load_scenario(case_dir)
+
+@lru_cache(maxsize=None)
+def get_available_merge_cases():
+    """Get list of available merge test case directory names"""
+    test_cases_dir = Path(__file__).parent / "merge_test_cases"
+    if not test_cases_dir.exists():
+        return []
+    return [d.name for d in test_cases_dir.iterdir() if d.is_dir()]
+
+# Listed once at import, shared by the tests parametrized over them
+MERGE_CASE_NAMES = get_available_merge_cases()
+
+@pytest.fixture(scope="session")
+def built_merge_state(request):
+    """Build a merge scenario once per session for all the merge tests: returns
+    (test_case, current_rules, state, summaries, expected_jsons), where state holds
+    every suggestion, summaries[i] is the summary comment after the first i + 1
+    suggestions and expected_jsons[i] is suggestion i's printed expected generation"""
+    test_case = load_specific_merge_test_case(request.param)
+    if not test_case:
+        return None, [], None, (), ()
+    current_rules = convert_to_cursor_rules(test_case.get("existing_rules", {}))
+    state = SummaryState(suggestions=[])
+    summaries = []
+    for i, suggestion in enumerate(test_case["suggestions"], 1):
+        state.add_suggestion(i, convert_to_rule_generation_output(suggestion["expected_generation"]))
+        summaries.append(format_summary_comment(state, current_rules))
+    # Each test prints every expected generation, dump them once
+    expected_jsons = tuple(
+        dump_json(suggestion["expected_generation"])
+        for suggestion in test_case["suggestions"]
+    )
+    return test_case, current_rules, state, tuple(summaries), expected_jsons
+
+@pytest.mark.parametrize(
+    "built_merge_state",
+    sorted(MERGE_CASE_NAMES),
+    ids=lambda x: x,  # Use the case name as the test ID
+    indirect=True
+)
+def test_merge_suggestions(built_merge_state):
     """Test merging multiple suggestions into a summary comment"""
+    test_case, current_rules, state, summaries, expected_jsons = built_merge_state
     print_separator(f"Testing merge scenario: {test_case['name']}")
     print(f"Description: {test_case['description']}")
     
-    # Convert existing rules to CursorRule objects
-    current_rules = convert_to_cursor_rules(test_case.get("existing_rules", {}))
-    
     # Print existing rules
     if current_rules:
         print("\nExisting Rules:")
@@ -325,22 +400,10 @@ def test_merge_suggestions(test_case):
             print(f"\n{rule.file_path}:")
             print(rule.content)
     
-    # Create empty state
-    state = SummaryState(suggestions=[])
-    
     # Process each suggestion in order
-    for i, suggestion in enumerate(test_case["suggestions"], 1):
+    for i, (expected_json, summary) in enumerate(zip(expected_jsons, summaries), 1):
         print(f"\nProcessing suggestion #{i}:")
-        print(json.dumps(suggestion["expected_generation"], indent=2))
-        
-        # Convert to RuleGenerationOutput
-        rule_output = convert_to_rule_generation_output(suggestion["expected_generation"])
-        
-        # Add to state
-        state.add_suggestion(i, rule_output)
-        
-        # Generate summary
-        summary = format_summary_comment(state, current_rules)
+        print(expected_json)
         
         print(f"\nSummary after suggestion #{i}:")
         print(summary)
@@ -348,60 +411,23 @@ def test_merge_suggestions(test_case):
     # No assertions, we just want to see the output
     assert True 
 
-def load_specific_merge_test_case(case_name: str):
-    """Load a specific merge test case by directory name"""
-    test_cases_dir = Path(__file__).parent / "merge_test_cases"
-    if not test_cases_dir.exists():
-        return None
-        
-    case_dir = test_cases_dir / case_name
-    if not case_dir.exists() or not case_dir.is_dir():
-        return None
-        
-    # Load scenario metadata
-    with open(case_dir / "metadata.yaml") as f:
-        metadata = yaml.safe_load(f)
-        
-    # Load each suggestion in order
-    suggestions = []
-    for i, case_file in enumerate(sorted(case_dir.glob("[0-9]*.yaml")), 1):
-        with open(case_file) as f:
-            data = yaml.safe_load(f)
-            suggestions.append(data)
-            
-    return {
-        "name": metadata["name"],
-        "description": metadata.get("description", ""),
-        "existing_rules": metadata.get("existing_rules", {}),
-        "suggestions": suggestions
-    }
-
-def get_available_merge_cases():
-    """Get list of available merge test case directory names"""
-    test_cases_dir = Path(__file__).parent / "merge_test_cases"
-    if not test_cases_dir.exists():
-        return []
-    return [d.name for d in test_cases_dir.iterdir() if d.is_dir()]
-
 @pytest.mark.parametrize(
-    "case_name",
-    get_available_merge_cases(),
-    ids=lambda x: x  # Use the case name as the test ID
+    "built_merge_state",
+    MERGE_CASE_NAMES,
+    ids=lambda x: x,  # Use the case name as the test ID
+    indirect=True
 )
-def test_merge_case(case_name: str):
+def test_merge_case(built_merge_state, request):
     """Test a specific merge case directory"""
-    test_case = load_specific_merge_test_case(case_name)
+    test_case, current_rules, state, summaries, expected_jsons = built_merge_state
     if not test_case:
-        print(f"Could not find merge test case: {case_name}")
+        print(f"Could not find merge test case: {request.node.callspec.params['built_merge_state']}")
         pytest.skip("Test case not found")
         return
         
     print_separator(f"Testing merge scenario: {test_case['name']}")
     print(f"Description: {test_case['description']}")
     
-    # Convert existing rules to CursorRule objects
-    current_rules = convert_to_cursor_rules(test_case.get("existing_rules", {}))
-    
     # Print existing rules
     if current_rules:
         print("\nExisting Rules:")
@@ -409,11 +435,10 @@ def test_merge_case(case_name: str):
             print(f"\n{rule.file_path}:")
             print(rule.content)
     
-    # Create empty state
-    state = SummaryState(suggestions=[])
-    
     # Process each suggestion in order
-    for i, suggestion in enumerate(test_case["suggestions"], 1):
+    for i, (suggestion, summary, expected_json) in enumerate(
+        zip(test_case["suggestions"], summaries, expected_jsons), 1
+    ):
         print_separator(f"Processing suggestion #{i}")
         
         print("Suggestion Input:")
@@ -423,16 +448,7 @@ def test_merge_case(case_name: str):
         print(suggestion.get("code_context", "None"))
         
         print("\nExpected Generation:")
-        print(json.dumps(suggestion["expected_generation"], indent=2))
-        
-        # Convert to RuleGenerationOutput
-        rule_output = convert_to_rule_generation_output(suggestion["expected_generation"])
-        
-        # Add to state
-        state.add_suggestion(i, rule_output)
-        
-        # Generate summary
-        summary = format_summary_comment(state, current_rules)
+        print(expected_json)
         
         print_separator(f"Summary after suggestion #{i}")
         print(summary)
@@ -440,6 +456,11 @@ def test_merge_case(case_name: str):
     # No assertions, we just want to see the output
     assert True 
 
+@lru_cache(maxsize=None)
+def _b64(content: str) -> str:
+    """Base64-encode mocked file content, once per distinct content per session"""
+    return base64.b64encode(content.encode()).decode()
+
 def create_mock_pr():
     """Create a mock PR object with the minimum required attributes"""
     mock_pr = MagicMock()
@@ -449,25 +470,23 @@ def create_mock_pr():
     return mock_pr
 
 @pytest.mark.parametrize(
-    "case_name",
-    get_available_merge_cases(),
-    ids=lambda x: x  # Use the case name as the test ID
+    "built_merge_state",
+    MERGE_CASE_NAMES,
+    ids=lambda x: x,  # Use the case name as the test ID
+    indirect=True
 )
-def test_apply_changes(case_name: str):
+def test_apply_changes(built_merge_state, request):
     """Test applying multiple suggestions to files.
     This test mocks the GitHub API calls but validates the content we would commit."""
-    test_case = load_specific_merge_test_case(case_name)
+    test_case, current_rules, state, summaries, expected_jsons = built_merge_state
     if not test_case:
-        print(f"Could not find merge test case: {case_name}")
+        print(f"Could not find merge test case: {request.node.callspec.params['built_merge_state']}")
         pytest.skip("Test case not found")
         return
         
     print_separator(f"Testing apply changes for: {test_case['name']}")
     print(f"Description: {test_case['description']}")
     
-    # Convert existing rules to CursorRule objects
-    current_rules = convert_to_cursor_rules(test_case.get("existing_rules", {}))
-    
     # Print existing rules
     if current_rules:
         print("\nExisting Rules:")
@@ -475,19 +494,10 @@ def test_apply_changes(case_name: str):
             print(f"\n{rule.file_path}:")
             print(rule.content)
     
-    # Create empty state
-    state = SummaryState(suggestions=[])
-    
-    # Process each suggestion in order
-    for i, suggestion in enumerate(test_case["suggestions"], 1):
+    # Print each suggestion in order
+    for i, expected_json in enumerate(expected_jsons, 1):
         print(f"\nProcessing suggestion #{i}:")
-        print(json.dumps(suggestion["expected_generation"], indent=2))
-        
-        # Convert to RuleGenerationOutput
-        rule_output = convert_to_rule_generation_output(suggestion["expected_generation"])
-        
-        # Add to state
-        state.add_suggestion(i, rule_output)
+        print(expected_json)
     
     # Create a mock PR
     mock_pr = create_mock_pr()
@@ -495,32 +505,43 @@ def test_apply_changes(case_name: str):
     # Track what files would be created/updated
     expected_changes = {}
     
+    # Build the mocked directory listing and files once, the mocks only look them up
+    existing_rules = test_case.get("existing_rules", {})
+    dir_listing = orjson.dumps([
+        {"type": "file", "name": file_path.rsplit('/', 1)[-1], "path": file_path, "sha": f"mock-sha-{file_path}"}
+        for file_path in existing_rules
+        if file_path.startswith('.cursor/rules/')
+    ]).decode()
+    file_mocks = {}
+    for file_path, content in existing_rules.items():
+        # Verify content has proper frontmatter
+        if not content.startswith('---\n'):
+            # Add default frontmatter
+            content = f"---\ndescription: Default description\nglobs: \"*\"\n---\n{content}"
+        file_mocks[file_path] = MagicMock(
+            content=_b64(content),
+            sha="mock-sha"
+        )
+    blob_mocks = {f"mock-sha-{file_path}": mock_file for file_path, mock_file in file_mocks.items()}
+    
+    # Mock the rules directory listing, which goes through the requester directly
+    def mock_request_json(verb, url, parameters=None, headers=None, input=None):
+        if url.endswith('/contents/.cursor/rules'):
+            # An empty list if no rules exist, or a list of existing rules
+            return 200, {}, dir_listing
+        return 404, {}, ""
+    
+    mock_pr.base.repo.url = "https://api.github.com/repos/test/repo"
+    mock_pr.base.repo.requester.requestJson = mock_request_json
+    mock_pr.base.repo.get_git_blob = lambda sha: blob_mocks[sha]
+    
     # Mock the get_contents method to return existing files
     def mock_get_contents(path, ref):
-        # Handle directory requests
-        if path == '.cursor/rules':
-            # Return an empty list if no rules exist, or a list of existing rules
-            existing_rules = []
-            for file_path in test_case.get("existing_rules", {}):
-                if file_path.startswith('.cursor/rules/'):
-                    mock_file = MagicMock()
-                    mock_file.path = file_path
-                    mock_file.type = "file"
-                    existing_rules.append(mock_file)
-            return existing_rules
-            
         # Handle file requests
-        if path in test_case.get("existing_rules", {}):
-            content = test_case["existing_rules"][path]
-            # Verify content has proper frontmatter
-            if not content.startswith('---\n'):
+        if path in file_mocks:
+            if not existing_rules[path].startswith('---\n'):
                 print(f"\nWarning: Mock file {path} missing frontmatter")
-                # Add default frontmatter
-                content = f"---\ndescription: Default description\nglobs: \"*\"\n---\n{content}"
-            mock_file = MagicMock()
-            mock_file.content = base64.b64encode(content.encode()).decode()
-            mock_file.sha = "mock-sha"
-            return mock_file
+            return file_mocks[path]
             
         # For new files, act as if they don't exist
         raise Exception(f"File not found: {path}")
@@ -536,7 +557,9 @@ def test_apply_changes(case_name: str):
             try:
                 parts = content.split('---', 2)
                 if len(parts) >= 3:
-                    frontmatter = yaml.safe_load(parts[1])
+                    # Committed rules often keep an existing rule's frontmatter, so
+                    # the cached parse is reused for most blobs
+                    frontmatter = dict(parse_frontmatter(parts[1]))
                     if not frontmatter.get('description'):
                         print("\nWarning: Content missing description in frontmatter")
                     if not frontmatter.get('globs'):
@@ -573,5 +596,276 @@ def test_apply_changes(case_name: str):
         print(f"\nError applying changes: {str(e)}")
         raise
     
-    # No assertions yet - we just want to see what would be committed
-    assert True 
\ No newline at end of file
+    # A commit is only made when some file's content changed
+    assert result["changed"] == bool(expected_changes)
+
+def test_rules_listing_conditional():
+    """Test listing the rules directory with conditional requests: a 200 parses and
+    caches the rules, a 304 reuses them without fetching any blob, a 404 means no rules"""
+    print_separator("Testing conditional rules directory listing")
+    rule_content = "---\ndescription: Python standards\nglobs: **/*.py\n---\nUse type hints"
+    listing = orjson.dumps([
+        {"type": "file", "name": "python.mdc", "path": ".cursor/rules/python.mdc", "sha": "rule-sha"},
+        {"type": "file", "name": "README.md", "path": ".cursor/rules/README.md", "sha": "readme-sha"},
+        {"type": "dir", "name": "drafts", "path": ".cursor/rules/drafts", "sha": "dir-sha"}
+    ]).decode()
+    
+    # Each call answers with the next canned response and records the request headers
+    responses = []
+    request_headers = []
+    def mock_request_json(verb, url, parameters=None, headers=None, input=None):
+        request_headers.append(headers)
+        return responses.pop(0)
+    
+    repo = MagicMock()
+    repo.url = "https://api.github.com/repos/test/conditional-rules"
+    repo.full_name = "test/conditional-rules"
+    repo.requester.requestJson = mock_request_json
+    repo.get_git_blob.return_value = MagicMock(content=_b64(rule_content))
+    
+    # 200: the listing is parsed, only .mdc files are fetched, and the validators kept
+    responses.append((200, {"etag": '"listing-v1"'}, listing))
+    rules = get_current_rules(repo, ref="main")
+    print("Rules after 200:", [(rule.file_path, rule.sha, rule.globs) for rule in rules])
+    assert request_headers[-1] == {}
+    assert [(rule.file_path, rule.sha, rule.globs) for rule in rules] == [
+        (".cursor/rules/python.mdc", "rule-sha", ["**/*.py"])
+    ]
+    repo.get_git_blob.assert_called_once_with("rule-sha")
+    
+    # 304: revalidated with the ETag, the parsed rules come back without any blob fetch
+    repo.get_git_blob.reset_mock()
+    responses.append((304, {}, ""))
+    cached_rules = get_current_rules(repo, ref="main")
+    print("Request headers for 304:", request_headers[-1])
+    assert request_headers[-1] == {"If-None-Match": '"listing-v1"'}
+    assert cached_rules == rules
+    assert cached_rules is not rules  # Callers get their own list
+    repo.get_git_blob.assert_not_called()
+    
+    # A large rule whose body isn't valid UTF-8 is skipped when fetched, not accepted
+    # with its frontmatter and left to fail when its content is first read
+    header = rule_content.encode().split(b"Use type hints")[0]
+    repo.get_git_blob.return_value = MagicMock(
+        content=base64.b64encode(header + b"x" * 8192 + b"\xff\xfe").decode()
+    )
+    responses.append((200, {"etag": '"listing-v2"'}, listing))
+    invalid_rules = get_current_rules(repo, ref="invalid-utf8")
+    print("Rules with an undecodable body:", invalid_rules)
+    assert invalid_rules == []
+    
+    # 404: a ref without a rules directory has no rules
+    responses.append((404, {}, orjson.dumps({"message": "Not Found"}).decode()))
+    missing_rules = get_current_rules(repo, ref="no-rules")
+    print("Rules after 404:", missing_rules)
+    assert missing_rules == []
+
+def create_mock_graphql_pr(graphql_query):
+    """Create a mock PR whose requester answers GraphQL with the given function,
+    and every REST comment page with an empty list"""
+    mock_pr = MagicMock()
+    mock_pr.number = 7
+    mock_pr.base.repo.full_name = "test/graphql-comments"
+    mock_pr.base.repo.url = "https://api.github.com/repos/test/graphql-comments"
+    mock_pr.requester.graphql_query = graphql_query
+    mock_pr.requester.requestJson.return_value = (200, {}, "[]")
+    return mock_pr
+
+def test_comments_graphql():
+    """Test mapping GraphQL comment nodes onto REST comment objects, and falling back
+    to REST when the query fails"""
+    print_separator("Testing GraphQL comment fetching")
+    response = {"data": {"repository": {"pullRequest": {
+        "comments": {"totalCount": 1, "nodes": [
+            {"databaseId": 11, "body": "Summary", "url": "https://github.com/test/graphql-comments/pull/7#issuecomment-11"}
+        ]},
+        "reviewThreads": {"totalCount": 1, "nodes": [
+            {"comments": {"totalCount": 2, "nodes": [
+                {"databaseId": 21, "body": "Use logging", "url": "https://github.com/test/graphql-comments/pull/7#discussion_r21"},
+                {"databaseId": 22, "body": "Reply", "url": "https://github.com/test/graphql-comments/pull/7#discussion_r22"}
+            ]}}
+        ]}
+    }}}}
+    mock_pr = create_mock_graphql_pr(lambda query, variables: ({}, response))
+    issue_comments, review_comments = get_comments_graphql(mock_pr)
+    mapped = (
+        [(c.id, c.body, c.url, c.html_url) for c in issue_comments],
+        [(c.id, c.body, c.url, c.html_url) for c in review_comments]
+    )
+    print("Mapped comments:")
+    print(dump_json(mapped))
+    assert mapped == (
+        [(11, "Summary", "https://api.github.com/repos/test/graphql-comments/issues/comments/11",
+          "https://github.com/test/graphql-comments/pull/7#issuecomment-11")],
+        [(21, "Use logging", "https://api.github.com/repos/test/graphql-comments/pulls/comments/21",
+          "https://github.com/test/graphql-comments/pull/7#discussion_r21"),
+         (22, "Reply", "https://api.github.com/repos/test/graphql-comments/pulls/comments/22",
+          "https://github.com/test/graphql-comments/pull/7#discussion_r22")]
+    )
+    
+    # Errors in the response and a missing pull request both fall back to REST
+    def graphql_errors(query, variables):
+        raise GithubException(200, {"errors": [{"message": "Something went wrong"}]}, {})
+    failing = {
+        "errors": graphql_errors,
+        "null pull request": lambda query, variables: ({}, {"data": {"repository": {"pullRequest": None}}}),
+    }
+    for failure, graphql_query in failing.items():
+        mock_pr = create_mock_graphql_pr(graphql_query)
+        assert get_comments_graphql(mock_pr) is None
+        invalidate_comment_cache(mock_pr)
+        result = get_cached_comments(mock_pr)
+        print(f"Comments after GraphQL failure ({failure}):", result)
+        assert result == ([], [])
+        assert mock_pr.requester.requestJson.call_count == 2  # One REST page per comment list
+        invalidate_comment_cache(mock_pr)
+
+class StubChain:
+    """Chain whose ainvoke waits for `release`, counting calls and optionally failing"""
+    def __init__(self, fail_times: int = 0):
+        self.calls = 0
+        self.fail_times = fail_times
+        self.release = asyncio.Event()
+    
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        await self.release.wait()
+        if self.calls <= self.fail_times:
+            raise RuntimeError("model unavailable")
+        return RuleAnalysisOutput(should_create_rule=True, reason=f"Reason for {inputs['comment']}")
+
+@pytest.mark.asyncio
+async def test_invoke_cached_coalescing():
+    """Test that concurrent identical LLM calls share one invocation, that cancelling
+    one caller doesn't cancel it for the others, and that failures aren't cached"""
+    print_separator("Testing in-flight LLM call coalescing")
+    inputs = {"comment": "Please add tests", "context": "No additional code context provided."}
+    
+    # Two concurrent identical calls make one invocation, each caller gets its own copy
+    chain, cache = StubChain(), TTLCache(maxsize=8, ttl=60)
+    first = asyncio.create_task(invoke_cached(chain, cache, "analysis", inputs))
+    second = asyncio.create_task(invoke_cached(chain, cache, "analysis", inputs))
+    await asyncio.sleep(0)
+    chain.release.set()
+    first_result, second_result = await asyncio.gather(first, second)
+    print(f"Invocations for two concurrent calls: {chain.calls}")
+    assert chain.calls == 1
+    assert first_result == second_result and first_result is not second_result
+    assert len(cache) == 1 and not _in_flight
+    
+    # A cached result is returned without invoking the chain again
+    cached_result = await invoke_cached(chain, cache, "analysis", inputs)
+    assert chain.calls == 1 and cached_result == first_result
+    
+    # Cancelling one caller leaves the shared call running for the other
+    chain, cache = StubChain(), TTLCache(maxsize=8, ttl=60)
+    cancelled = asyncio.create_task(invoke_cached(chain, cache, "analysis", inputs))
+    waiting = asyncio.create_task(invoke_cached(chain, cache, "analysis", inputs))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    chain.release.set()
+    result = await waiting
+    print(f"Result after cancelling one caller: {result.reason}")
+    assert cancelled.cancelled()
+    assert chain.calls == 1 and result.reason == "Reason for Please add tests"
+    assert len(cache) == 1 and not _in_flight
+    
+    # A failure reaches every joined caller and isn't cached, so the next call retries
+    chain, cache = StubChain(fail_times=1), TTLCache(maxsize=8, ttl=60)
+    failing = [asyncio.create_task(invoke_cached(chain, cache, "analysis", inputs)) for _ in range(2)]
+    await asyncio.sleep(0)
+    chain.release.set()
+    results = await asyncio.gather(*failing, return_exceptions=True)
+    print(f"Results after a failed call: {results}")
+    assert chain.calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(cache) == 0 and not _in_flight
+    retried = await invoke_cached(chain, cache, "analysis", inputs)
+    assert chain.calls == 2 and retried.should_create_rule
+    
+    # Reformatting the comment reuses the entry, but reindented code context doesn't
+    chain.release.set()
+    await invoke_cached(chain, cache, "analysis", {**inputs, "comment": "Please  add\ntests "})
+    assert chain.calls == 2
+    await invoke_cached(chain, cache, "analysis", {**inputs, "context": "  No additional code context provided."})
+    print(f"Invocations after reformatting the comment and the context: {chain.calls}")
+    assert chain.calls == 3 and len(cache) == 2
+
+def test_comment_cache_revalidation():
+    """Test that cached PR comments are revalidated on every read, so a deleted
+    suggestion is noticed while an unchanged PR keeps its cached lists"""
+    print_separator("Testing comment cache revalidation")
+    suggestion_body = f"{SUGGESTION_SIGNATURE}\n<!--thread-root-5-->"
+    graphql_response = {"data": {"repository": {"pullRequest": {
+        "comments": {"totalCount": 0, "nodes": []},
+        "reviewThreads": {"totalCount": 1, "nodes": [
+            {"comments": {"totalCount": 1, "nodes": [
+                {"databaseId": 31, "body": suggestion_body, "url": "https://github.com/test/graphql-comments/pull/7#discussion_r31"}
+            ]}}
+        ]}
+    }}}}
+    mock_pr = create_mock_graphql_pr(lambda query, variables: ({}, graphql_response))
+    mock_pr.comments_url = "https://api.github.com/repos/test/graphql-comments/issues/7/comments"
+    mock_pr.review_comments_url = "https://api.github.com/repos/test/graphql-comments/pulls/7/comments"
+    review_pages = {"current": [{"id": 31, "body": suggestion_body}]}
+    def mock_request_json(verb, url, parameters=None, headers=None, input=None):
+        items = review_pages["current"] if url == mock_pr.review_comments_url else []
+        return 200, {}, orjson.dumps(items).decode()
+    mock_pr.requester.requestJson = mock_request_json
+    invalidate_comment_cache(mock_pr)
+    
+    first = get_cached_comments(mock_pr)
+    assert get_handled_thread_roots(mock_pr) == {5}
+    # Nothing changed: the revalidated read returns the cached lists themselves
+    assert get_cached_comments(mock_pr) is first
+    
+    # The suggestion is deleted on GitHub: the next read sees it without waiting for the TTL
+    review_pages["current"] = []
+    handled = get_handled_thread_roots(mock_pr)
+    print(f"Handled thread roots after the suggestion was deleted: {handled}")
+    assert handled == set()
+    assert get_cached_comments(mock_pr) == ([], [])
+    invalidate_comment_cache(mock_pr)
+
+@pytest.mark.asyncio
+async def test_apply_command_noop():
+    """Test that an apply whose changes leave every file unchanged reports that nothing
+    was applied and leaves the summary state un-applied"""
+    print_separator("Testing apply command with nothing to commit")
+    state = SummaryState(suggestions=[(1, RuleGenerationOutput(
+        should_generate=True,
+        reason="Already covered",
+        operation="update",
+        file_path=".cursor/rules/testing.mdc",
+        changes=[RuleChange(type="replacement", content="Write tests", text_to_replace="Write tests")]
+    ))])
+    summary_comment = MagicMock()
+    state_manager = MagicMock()
+    noop_result = {"sha": "head-sha", "changed": False}
+    with patch("app.handlers.find_or_create_summary", return_value=summary_comment), \
+            patch("app.handlers.parse_summary_state", return_value=state), \
+            patch("app.handlers.get_state_manager", return_value=state_manager), \
+            patch("app.handlers.apply_rule_changes", return_value=noop_result):
+        result = await handle_apply_command(create_mock_pr(), {"id": 1})
+    print(f"Apply command result: {result['message']}")
+    assert result["commits"] == noop_result and result["status_updates"] == 0
+    assert "Successfully applied" not in result["message"]
+    assert not state.is_applied
+    summary_comment.edit.assert_not_called()
+    state_manager.save_state.assert_not_called()
+
+def test_get_with_etag_errors():
+    """Test that conditional GETs raise PyGithub's specific exception types, so retries
+    and 404 handling see them like any other PyGithub call"""
+    print_separator("Testing conditional GET error types")
+    requester = MagicMock()
+    requester.requestJson.return_value = (404, {}, orjson.dumps({"message": "Not Found"}).decode())
+    with pytest.raises(UnknownObjectException):
+        get_with_etag(requester, "https://api.github.com/repos/test/missing/pulls/1")
+    requester.requestJson.return_value = (
+        403, {"x-ratelimit-remaining": "0"}, orjson.dumps({"message": "API rate limit exceeded"}).decode()
+    )
+    with pytest.raises(RateLimitExceededException) as excinfo:
+        get_with_etag(requester, "https://api.github.com/repos/test/limited/pulls/1")
+    print(f"Rate limited GET raised: {type(excinfo.value).__name__}")